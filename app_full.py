@@ -1,4 +1,41 @@
-from flask import Flask, request, render_template_string
+import argparse
+import codecs
+import csv
+import email
+import email.parser
+import email.policy
+import gc
+import hashlib
+import hmac
+import json
+import mmap
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from html.parser import HTMLParser
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; metrics and scoring fall back to pure Python
+    np = None
+
+try:
+    from scipy import sparse
+except ImportError:  # SciPy is optional; batch scoring uses dense NumPy instead
+    sparse = None
+
+from flask import Flask, request, render_template, jsonify
+from markupsafe import Markup
+
+from fallback_model import FALLBACK_CATEGORY, HashedFeatureStream, load_fallback_model, train_model
+from rule_profiler import RuleProfiler
+from prediction_log import PredictionLog
+from shadow import ShadowEvaluator
+from telemetry import LiveCounters, Telemetry
 
 app = Flask(__name__)
 
@@ -8,54 +45,1034 @@ app = Flask(__name__)
 
 INTENTS = ["casual", "congratulation", "meeting_request", "request_invoice"]
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Keyword rules live in an external file (JSON or TOML) so they can be
+# changed and reloaded without editing or redeploying this module.
+RULES_PATH = os.environ.get("EMAIL_INTENT_RULES", os.path.join(BASE_DIR, "rules.json"))
+
+
+# --- Text normalization ---
+# Text is folded for matching: casefolding, typographic quotes/apostrophes/
+# dashes to ASCII, full-width forms to ASCII, every kind of whitespace to a
+# plain space and invisible formatting characters removed. Runs of spaces
+# are left to the matchers (see make_matcher), which treat them as a single
+# space. A str.translate table over all of this would fall off CPython's
+# ASCII fast path as soon as the text holds one curly quote, so the work is
+# split into C-level passes instead.
+
+# Every code point for which str.isspace() is true (Unicode White_Space
+# plus the ASCII file/group/record/unit separators).
+_WHITESPACE = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680"
+    "\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a"
+    "\u2028\u2029\u202f\u205f\u3000"
+)
+
+# The only ASCII characters that fold to something other than lower():
+# control whitespace and the backtick. Newlines come first as the usual case.
+_ASCII_FOLDS = tuple((ch, " ") for ch in "\n\r\t\x0b\x0c\x1c\x1d\x1e\x1f") + (("`", "'"),)
+
+
+def _build_unicode_folds():
+    folds = {ch: " " for ch in _WHITESPACE if not ch.isascii()}
+    folds.update({chr(cp): chr(cp - 0xFEE0).casefold() for cp in range(0xFF01, 0xFF5F)})   # full-width ASCII
+    folds.update({ch: "'" for ch in "\u2018\u2019\u201a\u201b\u2032\u00b4"})
+    folds.update({ch: '"' for ch in "\u201c\u201d\u201e\u201f\u2033\u00ab\u00bb"})
+    folds.update({ch: "-" for ch in "\u2010\u2011\u2012\u2013\u2014\u2015\u2212\ufe63"})
+    folds.update({ch: "" for ch in "\u00ad\u200b\u200c\u200d\u2060\ufeff"})
+    return folds
+
+
+_UNICODE_FOLDS = _build_unicode_folds()
+_UNICODE_FOLD = re.compile("[" + re.escape("".join(_UNICODE_FOLDS)) + "]")
+
+
+def _fold_unicode(match):
+    return _UNICODE_FOLDS[match.group()]
+
+
+def normalize_text(text):
+    """
+    Fold text for matching (see above). ASCII text only needs lower() and a
+    substring check per foldable control character; other text is
+    casefolded and its typographic characters replaced in one regex pass.
+    """
+    if text.isascii():
+        text = text.lower()
+    else:
+        text = _UNICODE_FOLD.sub(_fold_unicode, text.casefold())
+    for ch, folded in _ASCII_FOLDS:
+        if ch in text:
+            text = text.replace(ch, folded)
+    return text
+
+
+def normalize_phrase(phrase):
+    """
+    A rule phrase in the form the automaton matches: folded like email text,
+    with whitespace runs collapsed and trimmed.
+    """
+    return " ".join(normalize_text(phrase).split())
+
+
+# Keyword lists shorter than this are matched with one `in` scan per keyword
+# (SubstringMatcher), which runs in C; the automaton's per-character Python
+# loop only catches up at around 100-150 keywords.
+AUTOMATON_MIN_KEYWORDS = int(os.environ.get("EMAIL_INTENT_AUTOMATON_MIN_KEYWORDS", "150"))
+
+_SPACE_RUN = re.compile(" {2,}")
+
+
+def make_matcher(patterns):
+    """
+    The faster matcher for this many keywords (see AUTOMATON_MIN_KEYWORDS).
+    """
+    patterns = tuple(patterns)
+    if len(patterns) >= AUTOMATON_MIN_KEYWORDS:
+        return KeywordAutomaton(patterns)
+    return SubstringMatcher(patterns)
+
+
+class SubstringMatcher:
+    """
+    Finds keywords with one substring test each. Same interface as
+    KeywordAutomaton; the streaming state is the tail of the text scanned
+    so far, long enough to hold all but the last character of a keyword.
+    A run of spaces in the text acts like a single space.
+    """
+
+    START = ""
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self._overlap = max(map(len, self.patterns), default=1) - 1
+
+    def _found(self, text, pids):
+        patterns = self.patterns
+        return [pid for pid in pids if patterns[pid] in text]
+
+    def advance(self, text, tail, hits):
+        text = tail + text
+        if "  " in text:
+            text = _SPACE_RUN.sub(" ", text)
+        hits.update(self._found(text, range(len(self.patterns))))
+        return text[max(len(text) - self._overlap, 0):] if self._overlap else ""
+
+    def scan(self, text):
+        if "  " in text:
+            text = _SPACE_RUN.sub(" ", text)
+        return set(self._found(text, range(len(self.patterns))))
+
+    def first(self, text, groups):
+        """
+        (group, ids) for the first of `groups` (ranges of pattern ids) with
+        a pattern in text, or (None, []). Later groups are never scanned.
+        """
+        if "  " in text:
+            text = _SPACE_RUN.sub(" ", text)
+        for group, pids in enumerate(groups):
+            found = self._found(text, pids)
+            if found:
+                return group, found
+        return None, []
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over a fixed list of keywords.
+    scan(text) returns the ids (list positions) of every keyword that
+    occurs in text, found in a single pass over the characters.
+    A run of spaces in the text acts like a single space: every state
+    entered on a space loops back to itself on further spaces.
+    The pass is a Python loop, so make_matcher() only picks this for
+    long keyword lists.
+    """
+
+    START = 0
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+
+        goto = [{}]
+        out = [()]
+        after_space = []
+        for pid, pattern in enumerate(self.patterns):
+            node = 0
+            for ch in pattern:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    out.append(())
+                    if ch == " ":
+                        after_space.append(nxt)
+                node = nxt
+            out[node] += (pid,)
+
+        # Breadth-first pass: resolve failure links and fold them into a
+        # full transition table so scanning never has to backtrack.
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            delta[node] = {**delta[fail[node]], **goto[node]}
+            out[node] += out[fail[node]]
+            for ch, nxt in goto[node].items():
+                fail[nxt] = delta[fail[node]].get(ch, 0) if node else 0
+                queue.append(nxt)
+
+        for node in after_space:
+            delta[node][" "] = node
+
+        self._delta = delta
+        self._out = out
+
+    def advance(self, text, node, hits):
+        """
+        Continue scanning from automaton state `node`, adding the ids of
+        matched keywords to `hits`. Returns the new state, so text can be
+        fed in chunks and keywords spanning two chunks are still found.
+        """
+        delta = self._delta
+        out = self._out
+        for ch in text:
+            node = delta[node].get(ch, 0)
+            if out[node]:
+                hits.update(out[node])
+        return node
+
+    def scan(self, text):
+        hits = set()
+        self.advance(text, 0, hits)
+        return hits
+
+    def first(self, text, groups):
+        hits = self.scan(text)
+        for group, pids in enumerate(groups):
+            found = [pid for pid in pids if pid in hits]
+            if found:
+                return group, found
+        return None, []
+
+
+class RuleSet:
+    """
+    Immutable, compiled keyword rules.
+    Intents are kept in priority order: the first intent with any matching
+    keyword wins. Keyword ids are positions in `keywords`.
+    For weighted scoring every keyword also carries a weight per label
+    (by default 1.0 for its own intent); `labels` is the score vector order.
+    """
+
+    __slots__ = ("intents", "categories", "keywords", "keyword_ranks", "keyword_weights",
+                 "labels", "default_intent", "default_score", "version", "source",
+                 "_matcher", "_rank_ids", "_weight_matrix")
+
+    def __init__(self, rules, default_intent="casual", source=None, default_score=0.5):
+        intents = []
+        categories = []
+        keywords = []
+        ranks = []
+        for rank, rule in enumerate(rules):
+            intents.append(rule["intent"])
+            categories.append(rule.get("category", rule["intent"]))
+            keywords.extend(rule["keywords"])
+            ranks.extend([rank] * len(rule["keywords"]))
+
+        self.intents = tuple(intents)
+        self.categories = tuple(categories)
+        self.keywords = tuple(keywords)
+        self.keyword_ranks = tuple(ranks)
+        self.default_intent = default_intent
+        self.default_score = default_score
+        self.source = source
+        self._matcher = make_matcher(self.keywords)
+        self._weight_matrix = None
+        bounds = [0]
+        for rule in rules:
+            bounds.append(bounds[-1] + len(rule["keywords"]))
+        self._rank_ids = tuple(range(start, stop) for start, stop in zip(bounds, bounds[1:]))
+
+        # Priority order first, so ties in weighted scoring favour the
+        # higher-priority intent, then the default and any other INTENTS.
+        labels = list(dict.fromkeys(self.intents + (default_intent,)))
+        labels += [label for label in INTENTS if label not in labels]
+        self.labels = tuple(labels)
+        label_index = {label: i for i, label in enumerate(self.labels)}
+
+        weights = []
+        for rank, rule in enumerate(rules):
+            for position in range(len(rule["keywords"])):
+                per_label = {rule["intent"]: 1.0}
+                if "weights" in rule:
+                    per_label = rule["weights"][position]
+                for label in per_label:
+                    if label not in label_index:
+                        label_index[label] = len(self.labels)
+                        self.labels += (label,)
+                weights.append(tuple((label_index[label], float(w)) for label, w in per_label.items()))
+        self.keyword_weights = tuple(weights)
+
+        fingerprint = json.dumps([self.intents, self.categories, self.keywords, self.keyword_ranks,
+                                  self.keyword_weights, default_intent, default_score])
+        self.version = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:12]
+
+    def resolve(self, hits):
+        """
+        Turn a set of matched keyword ids into (intent, category, keyword_ids).
+        """
+        if not hits:
+            return self.default_intent, self.default_intent, []
+
+        rank = min(self.keyword_ranks[kid] for kid in hits)
+        ids = [kid for kid in sorted(hits) if self.keyword_ranks[kid] == rank]
+        return self.intents[rank], self.categories[rank], ids
+
+    def hits(self, text):
+        """
+        Set of ids of all keywords in already normalized text, any intent.
+        """
+        return self._matcher.scan(text)
+
+    def match(self, text):
+        """
+        Return (intent, category, keyword_ids) for already normalized text.
+        """
+        rank, ids = self._matcher.first(text, self._rank_ids)
+        if rank is None:
+            return self.default_intent, self.default_intent, []
+        return self.intents[rank], self.categories[rank], ids
+
+    def scanner(self, budget=None, features=None):
+        return StreamScanner(self, self._matcher, budget, features)
+
+    def list_matchers(self):
+        """
+        One matcher per intent over just that intent's keywords (ids stay
+        relative to the list), for timing each list on its own.
+        """
+        return [make_matcher(self.keywords[ids.start:ids.stop]) for ids in self._rank_ids]
+
+    def weight_matrix(self):
+        """
+        keyword x label weight matrix (NumPy), built on first use.
+        """
+        if self._weight_matrix is None:
+            matrix = np.zeros((len(self.keywords), len(self.labels)))
+            for kid, weights in enumerate(self.keyword_weights):
+                for label, weight in weights:
+                    matrix[kid, label] = weight
+            self._weight_matrix = matrix
+        return self._weight_matrix
+
+    def score_vector(self, hits):
+        scores = [0.0] * len(self.labels)
+        for kid in hits:
+            for label, weight in self.keyword_weights[kid]:
+                scores[label] += weight
+        return scores
+
+    def score_result(self, scores, multi_label_ratio=0.5):
+        """
+        Turn raw label scores into intent, confidence, normalized scores and
+        the multi-label set (labels scoring at least `multi_label_ratio` of
+        the best one). The default intent competes with `default_score`.
+        """
+        scores = [max(score, 0.0) for score in scores]
+        default = self.labels.index(self.default_intent)
+        scores[default] += self.default_score if any(scores) else 1.0
+        total = sum(scores)
+        best = max(range(len(scores)), key=lambda i: (scores[i], -i))
+        labels = [self.labels[i] for i in range(len(scores))
+                  if scores[i] >= scores[best] * multi_label_ratio and scores[i] > 0
+                  and (i != default or i == best)]
+        return {
+            "intent": self.labels[best],
+            "confidence": round(scores[best] / total, 4),
+            "scores": {label: round(score / total, 4) for label, score in zip(self.labels, scores)},
+            "labels": labels,
+        }
+
+    def classify(self, text):
+        intent, category, ids = self.match(normalize_text(text))
+        return intent, category, [self.keywords[kid] for kid in ids]
+
+
+class StreamScanner:
+    """
+    Incremental matcher for text that arrives in chunks. At most `budget`
+    characters are scanned (None or 0 means no limit); feed() returns False
+    once the budget is used up so the caller can stop reading. With a
+    HashedFeatureStream as `features`, the fallback model's features are
+    collected alongside until the first keyword hit makes them unnecessary.
+    """
+
+    def __init__(self, rules, matcher, budget=None, features=None):
+        self.rules = rules
+        self.budget = budget or None
+        self.scanned_chars = 0
+        self.truncated = False
+        self.features = features
+        self._matcher = matcher
+        self._state = matcher.START
+        self._hits = set()
+
+    def feed(self, chunk):
+        if self.budget is not None:
+            room = self.budget - self.scanned_chars
+            if len(chunk) > room:
+                chunk = chunk[:room]
+                self.truncated = True
+        normalized = normalize_text(chunk)
+        self._state = self._matcher.advance(normalized, self._state, self._hits)
+        if self.features is not None:
+            if self._hits:
+                self.features = None
+            else:
+                self.features.feed(normalized)
+        self.scanned_chars += len(chunk)
+        return not self.truncated
+
+    def result(self):
+        return self.rules.resolve(self._hits)
+
+
+def parse_rules(data, source=None):
+    """
+    Validate a parsed rule document and compile it into a RuleSet.
+    Raises ValueError describing the first problem found.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("intents"), list):
+        raise ValueError("rule file must contain an 'intents' list")
+
+    rules = []
+    for position, rule in enumerate(data["intents"]):
+        if not isinstance(rule, dict) or not isinstance(rule.get("intent"), str):
+            raise ValueError(f"rule #{position + 1} has no 'intent' name")
+        intent = rule["intent"]
+        if not isinstance(rule.get("keywords"), list):
+            raise ValueError(f"rule '{intent}' needs a 'keywords' list")
+        keywords = []
+        weights = []
+        for keyword in rule["keywords"]:
+            # A keyword is a phrase, or {"phrase": ..., "weight": w, "weights": {intent: w}}
+            # where "weight" is its weight for this rule's intent (default 1.0).
+            if isinstance(keyword, dict):
+                phrase = keyword.get("phrase")
+                extra = keyword.get("weights", {})
+                if not isinstance(extra, dict) or not all(isinstance(label, str) for label in extra):
+                    raise ValueError(f"keyword '{phrase}' in rule '{intent}' needs 'weights' as an object"
+                                     " mapping intent names to numbers")
+                per_label = {intent: keyword.get("weight", 1.0), **extra}
+            else:
+                phrase, per_label = keyword, {intent: 1.0}
+            if not isinstance(phrase, str) or not phrase:
+                raise ValueError(f"rule '{intent}' has an empty or non-string keyword")
+            if not all(isinstance(w, (int, float)) and not isinstance(w, bool) for w in per_label.values()):
+                raise ValueError(f"keyword '{phrase}' has a non-numeric weight")
+            phrase = normalize_phrase(phrase)
+            if not phrase:
+                raise ValueError(f"rule '{intent}' has a keyword that is only whitespace")
+            keywords.append(phrase)
+            weights.append(per_label)
+        priority = rule.get("priority", position + 1)
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            raise ValueError(f"rule '{intent}' has a non-integer 'priority'")
+        rules.append((priority, position, {
+            "intent": intent,
+            "category": rule.get("category", intent),
+            "keywords": keywords,
+            "weights": weights,
+        }))
+
+    rules.sort(key=lambda item: item[:2])
+    default_intent = data.get("default_intent", "casual")
+    if not isinstance(default_intent, str) or not default_intent:
+        raise ValueError("'default_intent' must be a non-empty string")
+    default_score = data.get("default_score", 0.5)
+    if not isinstance(default_score, (int, float)) or isinstance(default_score, bool):
+        raise ValueError("'default_score' must be a number")
+    return RuleSet([rule for _, _, rule in rules], default_intent, source, float(default_score))
+
+
+def load_rules(path=None):
+    path = path or RULES_PATH
+    with open(path, "rb") as fh:
+        if path.endswith(".toml"):
+            try:
+                import tomllib   # standard library from Python 3.11; only needed for .toml rules
+            except ImportError:
+                raise ValueError("TOML rule files need Python 3.11 or newer; use rules.json") from None
+            data = tomllib.load(fh)
+        else:
+            data = json.load(fh)
+    return parse_rules(data, source=path)
+
+
+_active_rules = load_rules()
+_rules_reload_lock = threading.Lock()
+
+
+def get_rules():
+    return _active_rules
+
+
+def reload_rules(path=None):
+    """
+    Build a new RuleSet from disk and swap it in.
+    Requests already running keep the rule set they started with; if the
+    file is invalid the error propagates and the active rules are kept.
+    """
+    global _active_rules
+    with _rules_reload_lock:
+        rules = load_rules(path or _active_rules.source)
+        _active_rules = rules
+    return rules
+
+
+class RuleFileWatcher(threading.Thread):
+    """
+    Background thread that reloads the rules whenever the rule file changes.
+    """
+
+    def __init__(self, path=None, interval=2.0):
+        super().__init__(name="rule-file-watcher", daemon=True)
+        self.path = path or RULES_PATH
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def run(self):
+        last = self._signature()
+        while not self._stop_event.wait(self.interval):
+            current = self._signature()
+            if current is None or current == last:
+                continue
+            last = current
+            try:
+                rules = reload_rules(self.path)
+            except (OSError, ValueError) as exc:
+                app.logger.warning("Keeping previous rules, reload of %s failed: %s", self.path, exc)
+            else:
+                app.logger.info("Reloaded rules from %s (version %s)", self.path, rules.version)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+
+_rules_watcher = None
+_rules_watcher_pid = None
+_rules_watcher_lock = threading.Lock()
+
+
+def start_rules_watcher():
+    """
+    Start the rule-file watcher when EMAIL_INTENT_RULES_WATCH (seconds) is set.
+    At most one runs per process; a watcher started before a fork() does
+    not survive in the child, which starts its own on the next call.
+    """
+    global _rules_watcher, _rules_watcher_pid
+    with _rules_watcher_lock:
+        watcher = _rules_watcher
+        if _rules_watcher_pid == os.getpid() and (watcher is None or not watcher.stopped()):
+            return watcher
+        _rules_watcher_pid = os.getpid()
+        interval = float(os.environ.get("EMAIL_INTENT_RULES_WATCH", "0") or 0)
+        if interval <= 0:
+            _rules_watcher = None
+            return None
+        watcher = _rules_watcher = RuleFileWatcher(_active_rules.source, interval)
+        watcher.start()
+        return watcher
+
+
+class ClassificationCache:
+    """
+    Bounded LRU cache of match results, keyed by a hash of the raw scan
+    window, so a hit costs a hash and a lookup and the text is only
+    normalized on a miss. Entries belong to one rule-set version: the
+    first lookup under a new version drops everything cached for the
+    previous one.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text):
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    def get(self, version, key):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return result
+
+    def put(self, version, key, result):
+        with self._lock:
+            if version != self._version:
+                return
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "rules_version": self._version,
+            }
+
+
+# Set EMAIL_INTENT_CACHE_SIZE=0 to disable the result cache.
+_cache_size = int(os.environ.get("EMAIL_INTENT_CACHE_SIZE", "4096"))
+RESULT_CACHE = ClassificationCache(_cache_size) if _cache_size > 0 else None
+
+
+# Hard ceiling on characters scanned per email (0 = unlimited). Subjects are
+# placed first by message_text(), so they always fall inside the window.
+SCAN_BUDGET = int(os.environ.get("EMAIL_INTENT_SCAN_BUDGET", "262144"))
+
+
+def exceeds_scan_budget(text):
+    return bool(SCAN_BUDGET) and len(text) > SCAN_BUDGET
+
+
+def raw_window(text):
+    """
+    The part of an email that gets scanned, before normalization.
+    """
+    if exceeds_scan_budget(text):
+        return text[:SCAN_BUDGET]
+    return text
+
+
+def scan_window(text):
+    """
+    The normalized part of an email that gets scanned.
+    """
+    return normalize_text(raw_window(text))
+
+
+def match_email(text, rules=None, fallback=True):
+    """
+    Return (intent, category, keyword_ids) for raw email text, using the
+    result cache when it is enabled. Only the first SCAN_BUDGET characters
+    are scanned. When no rule fires the fallback model (if loaded and
+    `fallback` is true) may still pick an intent, with an empty id list.
+    """
+    rules = rules or get_rules()
+    window = raw_window(text)
+    intent, category, ids, normalized = _match_cached(window, rules)
+
+    model = FALLBACK_MODEL
+    if fallback and not ids and model is not None:
+        if normalized is None:
+            normalized = normalize_text(window)
+        intent, category = model.fallback(model.predict(normalized), rules.default_intent)
+    return intent, category, ids
+
+
+def match_result(rules, intent, category, ids, **extra):
+    """
+    Result dict for an (intent, category, keyword_ids) answer, as returned
+    by the API, the CLI and the workers; `extra` fields are appended.
+    """
+    return {"intent": intent, "category": category, "keyword_ids": ids,
+            "matched_keywords": [rules.keywords[kid] for kid in ids], **extra}
+
+
+def _match_cached(window, rules):
+    """
+    match() for a raw scan window, plus the normalized window when it had
+    to be computed (None on a cache hit).
+    """
+    cache = RESULT_CACHE
+    if cache is None:
+        normalized = normalize_text(window)
+        return (*rules.match(normalized), normalized)
+
+    key = cache.key(window)
+    result = cache.get(rules.version, key)
+    if result is not None:
+        return result[0], result[1], list(result[2]), None
+    normalized = normalize_text(window)
+    intent, category, ids = rules.match(normalized)
+    cache.put(rules.version, key, (intent, category, tuple(ids)))
+    return intent, category, ids, normalized
+
+
+def match_uncached(text, rules):
+    """
+    match_email() without the result cache, for bulk and background work
+    (evaluation, shadowing) whose texts would otherwise evict live entries
+    and skew the cache counters.
+    """
+    normalized = scan_window(text)
+    intent, category, ids = rules.match(normalized)
+    model = FALLBACK_MODEL
+    if not ids and model is not None:
+        intent, category = model.fallback(model.predict(normalized), rules.default_intent)
+    return intent, category, ids
+
 
 def classify_email(text: str):
     """
     Classify email and return:
     (predicted_intent, matched_category, matched_keywords)
     """
-    t = text.lower()
+    rules = get_rules()
+    intent, category, ids = match_email(text, rules)
+    return intent, category, [rules.keywords[kid] for kid in ids]
 
-    # --- request_invoice keywords ---
-    invoice_keywords = [
-        "invoice", "bill", "billing", "payment receipt", "payment details",
-        "amount due", "outstanding payment", "pending payment",
-        "send the invoice", "share the invoice", "forward the invoice",
-        "request the invoice",
-    ]
-    matched_invoice = [k for k in invoice_keywords if k in t]
-    if matched_invoice:
-        return "request_invoice", "request_invoice", matched_invoice
-
-    # --- meeting_request keywords ---
-    meeting_keywords = [
-        "meeting request", "request a meeting", "schedule a meeting",
-        "set up a meeting", "book a meeting", "arrange a meeting",
-        "can we meet", "let's meet", "let us meet", "fix a meeting",
-        "meeting tomorrow", "meeting on", "catch up for a meeting",
-        "zoom call", "teams call", "google meet", "video call",
-        "discuss this further", "connect for a call",
-    ]
-    matched_meeting = [k for k in meeting_keywords if k in t]
-    if matched_meeting:
-        return "meeting_request", "meeting_request", matched_meeting
-
-    # --- congratulation keywords ---
-    congrats_keywords = [
-        "congratulations", "congrats", "well done", "great job",
-        "proud of you", "happy for you", "kudos", "big congratulations",
-        "heartfelt congratulations", "many congratulations", "you deserve this",
+
+def score_email(text, rules=None, multi_label_ratio=0.5):
+    """
+    Weighted scoring instead of the first-match cascade: every matched
+    keyword adds its weights to a score vector over the rule labels.
+    Returns {"intent", "confidence", "scores", "labels"}.
+    """
+    rules = rules or get_rules()
+    hits = rules.hits(scan_window(text))
+    return rules.score_result(rules.score_vector(hits), multi_label_ratio)
+
+
+def score_batch(texts, rules=None, multi_label_ratio=0.5):
+    """
+    score_email() for many texts at once. The scans fill a sparse
+    email x keyword hit matrix which is multiplied by the keyword x label
+    weight matrix, and normalization/argmax/multi-label selection are array
+    operations (SciPy sparse when available, NumPy otherwise).
+    """
+    rules = rules or get_rules()
+    hit_rows = [sorted(rules.hits(scan_window(text))) for text in texts]
+    if np is None:
+        return [rules.score_result(rules.score_vector(hits), multi_label_ratio) for hits in hit_rows]
+
+    n = len(hit_rows)
+    weights = rules.weight_matrix()
+    lengths = np.fromiter((len(hits) for hits in hit_rows), dtype=np.int64, count=n)
+    indices = np.fromiter((kid for hits in hit_rows for kid in hits), dtype=np.int64, count=int(lengths.sum()))
+    if sparse is not None:
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        hit_matrix = sparse.csr_matrix((np.ones(len(indices)), indices, indptr),
+                                       shape=(n, len(rules.keywords)))
+        scores = np.asarray(hit_matrix @ weights)
+    else:
+        scores = np.zeros((n, len(rules.labels)))
+        np.add.at(scores, np.repeat(np.arange(n), lengths), weights[indices])
+
+    scores = np.maximum(scores, 0.0)
+    default = rules.labels.index(rules.default_intent)
+    scores[:, default] += np.where(scores.sum(axis=1) > 0, rules.default_score, 1.0)
+    probs = scores / scores.sum(axis=1, keepdims=True)
+    best = probs.argmax(axis=1)
+    confidence = probs[np.arange(n), best]
+    selected = (probs >= confidence[:, None] * multi_label_ratio) & (probs > 0)
+    selected[:, default] &= best == default
+
+    labels = rules.labels
+    probs = np.round(probs, 4).tolist()
+    return [
+        {
+            "intent": labels[b],
+            "confidence": round(c, 4),
+            "scores": dict(zip(labels, row)),
+            "labels": [labels[i] for i in np.flatnonzero(mask)],
+        }
+        for b, c, row, mask in zip(best.tolist(), confidence.tolist(), probs, selected)
     ]
-    matched_congrats = [k for k in congrats_keywords if k in t]
-    if matched_congrats:
-        return "congratulation", "congratulation", matched_congrats
 
-    # Default intent when no rule matches
-    return "casual", "casual", []
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def classify_stream(stream, rules=None, budget=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Classify a binary stream (e.g. an upload) chunk by chunk, never holding
+    more than one chunk in memory, and stop reading once the scan budget is
+    reached. Returns a result dict including the truncation details.
+    """
+    rules = rules or get_rules()
+    model = FALLBACK_MODEL
+    features = HashedFeatureStream(model.n_features) if model is not None else None
+    scanner = rules.scanner(SCAN_BUDGET if budget is None else budget, features)
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    bytes_read = 0
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            scanner.feed(decoder.decode(b"", final=True))
+            break
+        bytes_read += len(data)
+        if not scanner.feed(decoder.decode(data)):
+            break
+
+    intent, category, ids = scanner.result()
+    if not ids and model is not None:
+        intent, category = model.fallback(model.predict_features(features.indices()), rules.default_intent)
+    return match_result(rules, intent, category, ids, scanned_chars=scanner.scanned_chars,
+                        bytes_read=bytes_read, truncated=scanner.truncated)
+
+
+# --- MIME preprocessing ---
+# Raw RFC 822 messages are reduced to subject + new body text before
+# matching: attachments are never decoded, HTML markup is stripped and
+# quoted replies / signatures are dropped.
+
+MAX_MESSAGE_BYTES = int(os.environ.get("EMAIL_INTENT_MAX_MESSAGE_BYTES", str(4 * 1024 * 1024)))
+
+_HEADER_LINE = re.compile(r"^[A-Za-z][A-Za-z0-9-]*:[ \t]")
+_REPLY_SEPARATOR = re.compile(r"^(-{2,}\s*(original|forwarded) message\s*-{2,}|_{10,}|sent from my \w+)",
+                              re.IGNORECASE)
+
+
+class _HTMLText(HTMLParser):
+    """
+    Collects the visible text of an HTML body, skipping scripts, styles and
+    quoted history (<blockquote>, Gmail's "gmail_quote" container).
+    """
+
+    SKIP_TAGS = {"script", "style", "head", "blockquote"}
+    BREAK_TAGS = {"br", "p", "div", "li", "tr", "h1", "h2", "h3", "h4"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+        self._quote_divs = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self._quote_divs:
+            if tag == "div":
+                self._quote_divs += 1
+        elif tag == "div" and "gmail_quote" in (dict(attrs).get("class") or ""):
+            self._quote_divs = 1
+        elif tag in self.SKIP_TAGS:
+            self._skip += 1
+        elif tag in self.BREAK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if self._quote_divs:
+            if tag == "div":
+                self._quote_divs -= 1
+        elif tag in self.SKIP_TAGS and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip and not self._quote_divs:
+            self.parts.append(data)
+
+
+def html_to_text(markup):
+    parser = _HTMLText()
+    parser.feed(markup)
+    parser.close()
+    return "".join(parser.parts)
+
+
+def strip_quoted_reply(text):
+    """
+    Keep only the new part of a reply: stop at the first reply header,
+    forwarded/original-message separator or signature delimiter, and drop
+    ">"-quoted lines.
+    """
+    lines = text.splitlines()
+    kept = []
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith(">"):
+            continue
+        following = lines[i + 1].strip() if i + 1 < len(lines) else ""
+        if (line.rstrip() == "--"
+                or _REPLY_SEPARATOR.match(stripped)
+                or (stripped.startswith("On ") and (stripped.endswith("wrote:") or following.endswith("wrote:")))
+                or (stripped.startswith("From:") and following.startswith(("Sent:", "Date:")))):
+            break
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def looks_like_rfc822(text):
+    """
+    True when text starts with a real mail header block (not just a pasted
+    "Subject:" line): MIME headers, or From together with To or Date.
+    """
+    head = text.lstrip()[:8192].replace("\r\n", "\n").split("\n\n", 1)[0]
+    names = {line.split(":", 1)[0].lower() for line in head.splitlines() if _HEADER_LINE.match(line)}
+    return bool(names & {"mime-version", "content-type"}) or ("from" in names and bool(names & {"to", "date"}))
+
+
+def parse_message(raw):
+    if isinstance(raw, str):
+        return email.message_from_string(raw, policy=email.policy.default)
+    return email.message_from_bytes(raw, policy=email.policy.default)
+
+
+def read_message(stream, max_bytes=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Parse a message from a binary stream, reading at most `max_bytes`
+    (default MAX_MESSAGE_BYTES). Returns (message, bytes_read, truncated).
+    """
+    limit = MAX_MESSAGE_BYTES if max_bytes is None else max_bytes
+    parser = email.parser.BytesFeedParser(policy=email.policy.default)
+    bytes_read = 0
+    while not limit or bytes_read < limit:
+        data = stream.read(chunk_size if not limit else min(chunk_size, limit - bytes_read))
+        if not data:
+            return parser.close(), bytes_read, False
+        parser.feed(data)
+        bytes_read += len(data)
+    return parser.close(), bytes_read, bool(stream.read(1))
+
+
+def message_text(msg):
+    """
+    Subject plus the new content of a parsed message: the text/plain body,
+    or the text/html body with markup stripped, minus quoted replies and
+    signatures. Attachments and other parts are never decoded.
+    """
+    subject = str(msg.get("subject", ""))
+    body = msg.get_body(preferencelist=("plain", "html"))
+    if body is None:
+        return subject
+
+    try:
+        content = body.get_content()
+    except (LookupError, UnicodeError):
+        content = body.get_payload(decode=True).decode("utf-8", "replace")
+    if body.get_content_subtype() == "html":
+        content = html_to_text(content)
+    return subject + "\n" + strip_quoted_reply(content)
+
+
+def preprocess_email(raw):
+    """
+    Text to classify for a raw RFC 822 message (bytes or str).
+    """
+    return message_text(parse_message(raw))
+
+
+def classify_message_stream(stream, rules=None):
+    """
+    Like classify_stream(), for a raw RFC 822 message: the message is parsed
+    from at most MAX_MESSAGE_BYTES and only its new text is scanned.
+    """
+    rules = rules or get_rules()
+    msg, bytes_read, message_truncated = read_message(stream)
+    text = message_text(msg)
+    intent, category, ids = match_email(text, rules)
+    truncated = exceeds_scan_budget(text)
+    return match_result(rules, intent, category, ids, scanned_chars=SCAN_BUDGET if truncated else len(text),
+                        bytes_read=bytes_read, truncated=truncated or message_truncated)
+
+
+def prepare_text(text, fmt="auto"):
+    """
+    Text to classify for user input: raw messages ("rfc822", or "auto" when
+    the text starts with a mail header block) are preprocessed, anything
+    else is used as is.
+    """
+    if fmt == "rfc822" or (fmt == "auto" and looks_like_rfc822(text)):
+        return preprocess_email(text)
+    return text
+
+# --- Fallback model ---
+# The hashed-feature model itself lives in fallback_model.py; it is trained
+# here on the rows the rules leave uncovered.
+
+def train_fallback_model(source, rules=None, n_features=2 ** 18, epochs=5, learning_rate=0.2,
+                         all_rows=False, progress=None):
+    """
+    Train the fallback model over a labelled dataset (any source accepted
+    by iter_labelled_dataset), streaming it once per epoch. By default only
+    rows on which no rule fires are used, since that is the only traffic
+    the model will see.
+    """
+    rules = rules or get_rules()
+
+    def rows():
+        for text, label in iter_labelled_dataset(source):
+            normalized = scan_window(text)
+            if all_rows or not rules.hits(normalized):
+                yield normalized, label
+
+    return train_model(rows, rules.labels, n_features, epochs, learning_rate, progress)
+
+
+FALLBACK_MODEL = load_fallback_model()
+
+# --- Rule profiling ---
+# RuleProfiler (rule_profiler.py) over a sample of live requests.
+
+# Fraction of web/API requests profiled (EMAIL_INTENT_PROFILE_SAMPLE, 0 = off).
+PROFILE_SAMPLE_RATE = float(os.environ.get("EMAIL_INTENT_PROFILE_SAMPLE", "0") or 0)
+_live_profiler = None
 
 
+def maybe_profile(text):
+    global _live_profiler
+    if not PROFILE_SAMPLE_RATE or random.random() >= PROFILE_SAMPLE_RATE:
+        return
+    rules = get_rules()
+    profiler = _live_profiler
+    if profiler is None or profiler.rules is not rules:
+        profiler = _live_profiler = RuleProfiler(rules)
+    profiler.record(scan_window(text))
+
+
+# --- Shadow evaluation ---
+# ShadowEvaluator (shadow.py) for a candidate posted to /admin/shadow.
+
+SHADOW_SAMPLE_RATE = float(os.environ.get("EMAIL_INTENT_SHADOW_SAMPLE", "0.1") or 0)
+_shadow = None
+
+
+def maybe_shadow(text, active_intent):
+    shadow = _shadow
+    if shadow is not None:
+        shadow.submit(text, active_intent)
+
 # -------------------------------------------------
-# 2. Evaluation dataset (built in)
+# 2. Evaluation datasets (built in + external files)
 # -------------------------------------------------
 
 EVALUATION_DATASET = [
@@ -81,57 +1098,338 @@ EVALUATION_DATASET = [
 ]
 
 
+# External labelled corpora can replace the built-in list (see EMAIL_INTENT_DATASET).
+EVALUATION_SOURCE = os.environ.get("EMAIL_INTENT_DATASET") or None
+
+MANIFEST_NAMES = ("labels.csv", "labels.jsonl")
+
+
+def _iter_mapped_lines(path):
+    """
+    Yield decoded lines of a file through a read-only memory map, so large
+    corpora are paged in by the OS instead of being read into memory.
+    """
+    with open(path, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for line in iter(mapped.readline, b""):
+                yield line.decode("utf-8", "replace")
+
+
+def _iter_csv_rows(path, text_field, label_field):
+    reader = csv.DictReader(_iter_mapped_lines(path))
+    missing = {text_field, label_field} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"{path}: missing CSV column(s) {', '.join(sorted(missing))}")
+    for row in reader:
+        yield row[text_field], row[label_field]
+
+
+def _iter_jsonl_rows(path, text_field, label_field):
+    for line_no, line in enumerate(_iter_mapped_lines(path), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            yield record[text_field], record[label_field]
+        except (ValueError, KeyError, TypeError) as exc:
+            raise ValueError(f"{path}:{line_no}: bad labelled record ({exc})") from None
+
+
+def _iter_eml_directory(path):
+    for name in MANIFEST_NAMES:
+        manifest = os.path.join(path, name)
+        if os.path.exists(manifest):
+            break
+    else:
+        raise ValueError(f"{path}: no label manifest ({' or '.join(MANIFEST_NAMES)})")
+
+    rows = (_iter_csv_rows if manifest.endswith(".csv") else _iter_jsonl_rows)(manifest, "file", "label")
+    for filename, label in rows:
+        with open(os.path.join(path, filename), "rb") as fh:
+            msg = email.message_from_binary_file(fh, policy=email.policy.default)
+        yield message_text(msg), label
+
+
+def iter_labelled_dataset(source=None, text_field="text", label_field="label"):
+    """
+    Stream (text, label) pairs from the built-in dataset or an external
+    corpus: a .csv file, a .jsonl/.ndjson file, or a directory of .eml
+    files with a labels.csv / labels.jsonl manifest (columns file, label).
+    """
+    if source is None:
+        yield from EVALUATION_DATASET
+    elif os.path.isdir(source):
+        yield from _iter_eml_directory(source)
+    elif source.endswith(".csv"):
+        yield from _iter_csv_rows(source, text_field, label_field)
+    else:
+        yield from _iter_jsonl_rows(source, text_field, label_field)
+
 # -------------------------------------------------
 # 3. Metrics (pure Python – no sklearn)
 # -------------------------------------------------
 
+class ConfusionMatrix:
+    """
+    Incremental confusion matrix: counts[true][pred], filled in one pass.
+    Precision/recall/F1, averages and the full matrix are all derived from
+    the counts, so new labelled examples can be added at any time.
+    """
+
+    def __init__(self, labels=()):
+        self.labels = []
+        self._index = {}
+        self._counts = []
+        for label in labels:
+            self._label_index(label)
+
+    def _label_index(self, label):
+        index = self._index.get(label)
+        if index is None:
+            index = self._index[label] = len(self.labels)
+            self.labels.append(label)
+            for row in self._counts:
+                row.append(0)
+            self._counts.append([0] * len(self.labels))
+        return index
+
+    def update(self, true_label, pred_label, n=1):
+        self._counts[self._label_index(true_label)][self._label_index(pred_label)] += n
+
+    def update_many(self, true_labels, pred_labels):
+        """
+        Add paired label sequences: the pairs are counted with a Counter
+        first, so the matrix is only touched once per distinct pair.
+        """
+        for (true_label, pred_label), n in Counter(zip(true_labels, pred_labels)).items():
+            self._counts[self._label_index(true_label)][self._label_index(pred_label)] += n
+
+    @property
+    def total(self):
+        return sum(map(sum, self._counts))
+
+    @property
+    def correct(self):
+        return sum(self._counts[i][i] for i in range(len(self.labels)))
+
+    def matrix(self):
+        return [list(row) for row in self._counts]
+
+    def support_labels(self):
+        """
+        Labels that occur at least once as a true label, sorted.
+        """
+        return sorted(label for label in self.labels if sum(self._counts[self._index[label]]) > 0)
+
+    def label_counts(self, label):
+        i = self._index[label]
+        tp = self._counts[i][i]
+        fn = sum(self._counts[i]) - tp
+        fp = sum(row[i] for row in self._counts) - tp
+        return tp, fp, fn
+
+    def per_label(self, labels=None):
+        rows = []
+        for label in (self.support_labels() if labels is None else labels):
+            tp, fp, fn = self.label_counts(label)
+            precision, recall, f1 = _prf(tp, fp, fn)
+            rows.append({"label": label, "precision": precision, "recall": recall,
+                         "f1": f1, "support": tp + fn})
+        return rows
+
+    def averages(self, labels=None):
+        """
+        Micro, macro and support-weighted precision/recall/F1. Macro and
+        weighted average over labels with support; micro counts every label,
+        including ones that were only predicted, so for single-label data it
+        equals accuracy.
+        """
+        rows = self.per_label(labels)
+        if not rows:
+            return {}
+
+        tp = fp = fn = 0
+        for label in (self.labels if labels is None else labels):
+            label_tp, label_fp, label_fn = self.label_counts(label)
+            tp, fp, fn = tp + label_tp, fp + label_fp, fn + label_fn
+        micro = _prf(tp, fp, fn)
+
+        total_support = sum(row["support"] for row in rows)
+        averages = {"micro": dict(zip(("precision", "recall", "f1"), micro))}
+        averages["macro"] = {m: sum(row[m] for row in rows) / len(rows)
+                             for m in ("precision", "recall", "f1")}
+        averages["weighted"] = {m: (sum(row[m] * row["support"] for row in rows) / total_support
+                                    if total_support else 0.0)
+                                for m in ("precision", "recall", "f1")}
+        return averages
+
+    def summary(self, digits=2):
+        """
+        (accuracy, per_label, distribution) in the format used by the templates.
+        """
+        total = self.total
+        accuracy = round(self.correct / total, digits) if total > 0 else None
+
+        per_label = []
+        distribution = []
+        for row in self.per_label():
+            per_label.append({
+                "label": row["label"],
+                "precision": round(row["precision"], digits),
+                "recall": round(row["recall"], digits),
+                "f1": round(row["f1"], digits),
+                "support": row["support"],
+            })
+            distribution.append({"label": row["label"], "support": row["support"]})
+
+        return accuracy, per_label, distribution
+
+
+def _prf(tp, fp, fn):
+    precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
+    recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
+    f1 = (2 * precision * recall / (precision + recall)) if (precision + recall) > 0 else 0.0
+    return precision, recall, f1
+
+
 def compute_metrics(true_labels, pred_labels):
-    labels = sorted(set(true_labels))
-    total = len(true_labels)
-    correct = sum(1 for t, p in zip(true_labels, pred_labels) if t == p)
-    accuracy = round(correct / total, 2) if total > 0 else None
+    matrix = ConfusionMatrix()
+    matrix.update_many(true_labels, pred_labels)
+    return matrix.summary()
 
-    per_label = []
-    distribution = []
 
-    for label in labels:
-        tp = sum(1 for t, p in zip(true_labels, pred_labels)
-                 if t == label and p == label)
-        fp = sum(1 for t, p in zip(true_labels, pred_labels)
-                 if t != label and p == label)
-        fn = sum(1 for t, p in zip(true_labels, pred_labels)
-                 if t == label and p != label)
+def evaluate_classifier(rules=None, source=None, progress=None, progress_every=10000):
+    """
+    Evaluate the rules over a labelled dataset, streaming it row by row.
+    `source` defaults to EVALUATION_SOURCE, or the built-in dataset when that
+    is unset; `progress(rows_done)` is called every `progress_every` rows.
+    """
+    rules = rules or get_rules()
+    source = source or EVALUATION_SOURCE
 
-        support = tp + fn
-        precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
-        recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
-        f1 = (2 * precision * recall / (precision + recall)) if (precision + recall) > 0 else 0.0
+    matrix = ConfusionMatrix(INTENTS)
+    rows = 0
+    for text, label in iter_labelled_dataset(source):
+        matrix.update(label, match_uncached(text, rules)[0])
+        rows += 1
+        if progress is not None and rows % progress_every == 0:
+            progress(rows)
 
-        per_label.append({
-            "label": label,
-            "precision": round(precision, 2),
-            "recall": round(recall, 2),
-            "f1": round(f1, 2),
-            "support": support,
-        })
-        distribution.append({"label": label, "support": support})
+    return metrics_report(matrix, source)
 
-    return accuracy, per_label, distribution
 
+def metrics_report(matrix, source=None):
+    """
+    The evaluate_classifier() result (as shown on the dashboard) for a
+    filled ConfusionMatrix.
+    """
+    if matrix.total == 0:
+        return {"accuracy": None, "per_label": [], "distribution": [], "source": source}
+
+    accuracy, per_label, distribution = matrix.summary()
+    averages = {name: {m: round(v, 2) for m, v in scores.items()}
+                for name, scores in matrix.averages().items()}
+    return {
+        "accuracy": accuracy,
+        "per_label": per_label,
+        "distribution": distribution,
+        "averages": averages,
+        "confusion": {"labels": list(matrix.labels), "matrix": matrix.matrix()},
+        "source": source,
+    }
 
-def evaluate_classifier():
-    if not EVALUATION_DATASET:
-        return {"accuracy": None, "per_label": [], "distribution": []}
 
-    texts = [t for t, label in EVALUATION_DATASET]
-    true_labels = [label for t, label in EVALUATION_DATASET]
-    pred_labels = [classify_email(t)[0] for t in texts]
+def dataset_version():
+    if EVALUATION_SOURCE:
+        paths = [EVALUATION_SOURCE]
+        if os.path.isdir(EVALUATION_SOURCE):
+            paths += [os.path.join(EVALUATION_SOURCE, name) for name in MANIFEST_NAMES]
+        signature = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return format(hash(tuple(signature)) & 0xFFFFFFFFFFFF, "012x")
 
-    accuracy, per_label, distribution = compute_metrics(true_labels, pred_labels)
-    return {"accuracy": accuracy, "per_label": per_label, "distribution": distribution}
+    # Tuple hashing reuses the strings' cached hashes, so this stays cheap.
+    return format(hash(tuple(EVALUATION_DATASET)) & 0xFFFFFFFFFFFF, "012x")
 
 
-METRICS = evaluate_classifier()
+class MetricsCache:
+    """
+    Latest completed evaluation of the classifier, keyed by the rule-set
+    version and the evaluation dataset version. get() only re-evaluates when
+    either has changed; with background=True the previous snapshot keeps
+    being served while a worker thread computes the new one.
+    """
+
+    def __init__(self, background=False):
+        self.background = background
+        self._snapshot = None
+        self._version = None
+        self._compute_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._refreshing = False
+
+    def _current(self):
+        rules = get_rules()
+        return rules, f"{rules.version}-{dataset_version()}"
+
+    def _compute(self, rules, version):
+        with self._compute_lock:
+            if version != self._version:
+                metrics = evaluate_classifier(rules)
+                metrics["version"] = version
+                self._snapshot, self._version = metrics, version
+            return self._snapshot
+
+    def _refresh_in_background(self, rules, version):
+        try:
+            self._compute(rules, version)
+        except Exception:
+            app.logger.exception("Background evaluation failed")
+        finally:
+            with self._state_lock:
+                self._refreshing = False
+
+    def get(self, wait=False):
+        """
+        The current snapshot. In background mode a stale one (or, before the
+        first evaluation finishes, an empty "pending" one) is returned while
+        the evaluation runs, unless `wait` is true.
+        """
+        snapshot = self._snapshot
+        rules, version = self._current()
+        if snapshot is not None and snapshot["version"] == version:
+            return snapshot
+        if wait or not self.background:
+            return self._compute(rules, version)
+
+        with self._state_lock:
+            start = not self._refreshing
+            self._refreshing = True
+        if start:
+            threading.Thread(target=self._refresh_in_background, args=(rules, version),
+                             name="metrics-refresh", daemon=True).start()
+        if snapshot is None:
+            return {"accuracy": None, "per_label": [], "distribution": [], "source": EVALUATION_SOURCE,
+                    "pending": True, "version": "pending"}
+        return snapshot
+
+
+METRICS_CACHE = MetricsCache(background=os.environ.get("EMAIL_INTENT_METRICS_BACKGROUND") == "1")
+
+
+def __getattr__(name):
+    # METRICS used to be computed at import; it is now evaluated on first
+    # access so importing the module never scans an external dataset.
+    if name == "METRICS":
+        return METRICS_CACHE.get(wait=True)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # -------------------------------------------------
@@ -275,6 +1573,16 @@ textarea:focus {
     background: #ffffff;
 }
 
+textarea + label {
+    margin-top: 12px;
+}
+
+input[type="file"] {
+    display: block;
+    font-size: 0.85rem;
+    color: var(--text-muted);
+}
+
 /* ---------- BUTTONS ---------- */
 
 .btn {
@@ -550,7 +1858,7 @@ INDEX_TEMPLATE = """
 <head>
     <meta charset="UTF-8">
     <title>Email Intent Intelligence - Rule-Based</title>
-    <style>{{ css }}</style>
+    <link rel="stylesheet" href="{{ url_for('stylesheet', v=css_version) }}">
 </head>
 <body>
 <div class="page">
@@ -570,39 +1878,7 @@ INDEX_TEMPLATE = """
 
     <section class="layout">
         <main class="card main-card">
-            <h2>Test an Email</h2>
-            <form method="POST">
-                <label for="email_text">Paste or type an email</label>
-                <textarea id="email_text" name="email_text" rows="10"
-                          placeholder="Subject: ...&#10;&#10;Dear ...&#10;">{{ email_text }}</textarea>
-
-                <button type="submit" class="btn">Classify Intent</button>
-            </form>
-
-            {% if predicted_intent %}
-            <div class="result">
-                <h3>Predicted Intent</h3>
-                <p class="intent-badge">{{ predicted_intent }}</p>
-
-                <h4>Why this label?</h4>
-                {% if matched_keywords %}
-                    <p class="explain">
-                        Matched rule category: <strong>{{ matched_category }}</strong><br>
-                        Trigger keywords:
-                        <span class="kw-list">
-                        {% for kw in matched_keywords %}
-                            <span class="kw-chip">{{ kw }}</span>
-                        {% endfor %}
-                        </span>
-                    </p>
-                {% else %}
-                    <p class="explain">
-                        No specific rule keywords matched. The email is treated as
-                        <strong>casual</strong>.
-                    </p>
-                {% endif %}
-            </div>
-            {% endif %}
+            {{ prediction_block }}
         </main>
 
         <aside class="card side-card">
@@ -664,6 +1940,10 @@ INDEX_TEMPLATE = """
                 </tbody>
             </table>
         </div>
+        {% elif metrics and metrics.pending %}
+        <p class="note">
+            Evaluation is still running; refresh in a moment.
+        </p>
         {% else %}
         <p class="note">
             No evaluation data found.
@@ -718,13 +1998,62 @@ Let me know when you are free to catch up.`;
 </html>
 """
 
+# The part of the index page that changes per request; the rest of the page
+# is rendered once per metrics snapshot (see PageCache below).
+INDEX_FORM_TEMPLATE = """
+            <h2>Test an Email</h2>
+            <form method="POST" enctype="multipart/form-data">
+                <label for="email_text">Paste or type an email</label>
+                <textarea id="email_text" name="email_text" rows="10"
+                          placeholder="Subject: ...&#10;&#10;Dear ...&#10;">{{ email_text }}</textarea>
+
+                <label for="email_file">…or upload a message file (.txt / .eml)</label>
+                <input type="file" id="email_file" name="email_file" accept=".txt,.eml,text/plain,message/rfc822">
+
+                <button type="submit" class="btn">Classify Intent</button>
+            </form>
+
+            {% if predicted_intent %}
+            <div class="result">
+                <h3>Predicted Intent</h3>
+                <p class="intent-badge">{{ predicted_intent }}</p>
+                {% if scanned_chars %}
+                <p class="note">Long email: only the first {{ scanned_chars }} characters were scanned.</p>
+                {% endif %}
+
+                <h4>Why this label?</h4>
+                {% if matched_keywords %}
+                    <p class="explain">
+                        Matched rule category: <strong>{{ matched_category }}</strong><br>
+                        Trigger keywords:
+                        <span class="kw-list">
+                        {% for kw in matched_keywords %}
+                            <span class="kw-chip">{{ kw }}</span>
+                        {% endfor %}
+                        </span>
+                    </p>
+                {% elif matched_category == "fallback_model" %}
+                    <p class="explain">
+                        No specific rule keywords matched. The fallback model
+                        labelled the email as <strong>{{ predicted_intent }}</strong>.
+                    </p>
+                {% else %}
+                    <p class="explain">
+                        No specific rule keywords matched. The email is treated as
+                        <strong>casual</strong>.
+                    </p>
+                {% endif %}
+            </div>
+            {% endif %}
+"""
+
 DASHBOARD_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <title>Email Intent Dashboard</title>
-    <style>{{ css }}</style>
+    <link rel="stylesheet" href="{{ url_for('stylesheet', v=css_version) }}">
     <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
 </head>
 <body>
@@ -762,6 +2091,12 @@ DASHBOARD_TEMPLATE = """
                     {{ metrics.per_label | length }}
                 </span>
             </div>
+            {% if metrics.averages %}
+            <div class="dash-card">
+                <span class="dash-label">Macro F1</span>
+                <span class="dash-value">{{ metrics.averages.macro.f1 }}</span>
+            </div>
+            {% endif %}
         </div>
 
         <h2>Per-label Metrics</h2>
@@ -796,14 +2131,42 @@ DASHBOARD_TEMPLATE = """
         </div>
 
         <p class="note">
+            {% if metrics.source %}
+            Data is read from <code>{{ metrics.source }}</code> (set by <code>EMAIL_INTENT_DATASET</code>).
+            {% else %}
             Data is defined directly inside <code>EVALUATION_DATASET</code> in <code>app_full.py</code>.
             You can add more labelled emails there to update the dashboard.
+            {% endif %}
         </p>
+        {% elif metrics and metrics.pending %}
+        <p class="note">Evaluation is still running; refresh in a moment.</p>
         {% else %}
         <p class="note">No evaluation data found.</p>
         {% endif %}
     </section>
 
+    <section class="card metrics-card">
+        <div class="metrics-header-row">
+            <h2>Live</h2>
+        </div>
+        <div class="dashboard-cards">
+            <div class="dash-card">
+                <span class="dash-label">Predictions (window)</span>
+                <span class="dash-value" id="livePredictions">0</span>
+            </div>
+            <div class="dash-card">
+                <span class="dash-label">Avg latency (ms)</span>
+                <span class="dash-value" id="liveLatency">–</span>
+            </div>
+        </div>
+        <div class="chart-container">
+            <canvas id="liveChart"></canvas>
+        </div>
+        <p class="note">Predictions per time bucket, pushed from <code>/dashboard/stream</code> as they happen.</p>
+    </section>
+
+    {{ traffic_block }}
+
     <footer class="footer">
         <p>Email Intent Intelligence · Dashboard View</p>
     </footer>
@@ -841,13 +2204,240 @@ DASHBOARD_TEMPLATE = """
     });
 </script>
 {% endif %}
+<script>
+    (function () {
+        const buckets = new Map();
+        const chart = new Chart(document.getElementById('liveChart').getContext('2d'), {
+            type: 'bar',
+            data: { labels: [], datasets: [] },
+            options: {
+                responsive: true,
+                animation: false,
+                scales: {
+                    x: { stacked: true },
+                    y: { stacked: true, beginAtZero: true }
+                }
+            }
+        });
+
+        const source = new EventSource("{{ url_for('dashboard_stream') }}");
+        source.onmessage = function (event) {
+            const update = JSON.parse(event.data);
+            update.buckets.forEach(b => buckets.set(b.t, b));
+            const oldest = Date.now() / 1000 - update.bucket_seconds * update.window;
+            for (const t of buckets.keys()) {
+                if (t < oldest) buckets.delete(t);
+            }
+
+            const times = [...buckets.keys()].sort((a, b) => a - b);
+            const intents = [...new Set(times.flatMap(t => Object.keys(buckets.get(t).counts)))].sort();
+            chart.data.labels = times.map(t => new Date(t * 1000).toLocaleTimeString());
+            chart.data.datasets = intents.map(intent => ({
+                label: intent,
+                data: times.map(t => buckets.get(t).counts[intent] || 0)
+            }));
+            chart.update();
+
+            let count = 0, total = 0;
+            times.forEach(t => {
+                const b = buckets.get(t);
+                count += b.predictions;
+                total += b.latency_avg_ms * b.predictions;
+            });
+            document.getElementById('livePredictions').textContent = count;
+            document.getElementById('liveLatency').textContent = count ? (total / count).toFixed(3) : '–';
+        };
+    })();
+</script>
 </body>
 </html>
 """
 
+TRAFFIC_TEMPLATE = """
+{% if traffic is not none %}
+    <section class="card metrics-card">
+        <div class="metrics-header-row">
+            <h2>Live Traffic</h2>
+        </div>
+        {% if traffic.total %}
+        <div class="dashboard-cards">
+            <div class="dash-card">
+                <span class="dash-label">Predictions ({{ traffic.hours | length }}h)</span>
+                <span class="dash-value">{{ traffic.total }}</span>
+            </div>
+        </div>
+
+        <div class="table-wrapper">
+            <table class="metrics-table">
+                <thead>
+                    <tr>
+                        <th>Intent</th>
+                        <th>Predictions</th>
+                        <th>Avg latency (ms)</th>
+                        <th>Max latency (ms)</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {% for row in traffic.totals %}
+                    <tr>
+                        <td>{{ row.intent }}</td>
+                        <td>{{ row.predictions }}</td>
+                        <td>{{ row.avg_latency_ms }}</td>
+                        <td>{{ row.max_latency_ms }}</td>
+                    </tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+        </div>
+
+        <h2>Predictions per Hour</h2>
+        <div class="chart-container">
+            <canvas id="trafficChart"></canvas>
+        </div>
+        <script>
+            const traffic = {{ traffic | tojson }};
+            new Chart(document.getElementById('trafficChart').getContext('2d'), {
+                type: 'line',
+                data: {
+                    labels: traffic.hours,
+                    datasets: traffic.series.map(s => ({ label: s.intent, data: s.counts }))
+                },
+                options: {
+                    responsive: true,
+                    scales: {
+                        y: { beginAtZero: true }
+                    }
+                }
+            });
+        </script>
+        {% else %}
+        <p class="note">No predictions logged in the last {{ traffic.hours | length }} hours.</p>
+        {% endif %}
+        <p class="note">
+            Predictions from the classifier page are logged to <code>EMAIL_INTENT_LOG_DB</code>.
+        </p>
+    </section>
+{% endif %}
+"""
+
+
+# Templates are compiled once; invariant markup is rendered once per
+# metrics snapshot and reused, so a request only renders the form/result.
+
+CSS_VERSION = hashlib.sha1(BASE_CSS.encode("utf-8")).hexdigest()[:10]
+
+INDEX_PAGE = app.jinja_env.from_string(INDEX_TEMPLATE)
+INDEX_FORM = app.jinja_env.from_string(INDEX_FORM_TEMPLATE)
+DASHBOARD_PAGE = app.jinja_env.from_string(DASHBOARD_TEMPLATE)
+TRAFFIC_BLOCK = app.jinja_env.from_string(TRAFFIC_TEMPLATE)
+
+_SLOT = "\x00prediction-block\x00"
+
+
+class PageCache:
+    """
+    Pre-rendered pages for the latest metrics snapshot: the index page split
+    around the prediction block, and the dashboard split around the live
+    traffic block. The shells hold url_for() links, so they are kept per
+    script root (the prefix the app is mounted under, e.g. SCRIPT_NAME).
+    """
+
+    # More prefixes than this are rendered per request instead of cached.
+    MAX_ROOTS = 16
+
+    def __init__(self):
+        self._state = (None, {})   # (metrics version, {script root: shells})
+        self._lock = threading.Lock()
+
+    def _render(self, metrics):
+        shell = render_template(INDEX_PAGE, css_version=CSS_VERSION, metrics=metrics,
+                                prediction_block=Markup(_SLOT))
+        index_parts = tuple(shell.split(_SLOT))
+        shell = render_template(DASHBOARD_PAGE, css_version=CSS_VERSION, metrics=metrics,
+                                traffic_block=Markup(_SLOT))
+        return index_parts, tuple(shell.split(_SLOT))
+
+    def _shells(self, metrics):
+        # Needs a request context for url_for, so it runs on first use.
+        version = metrics.get("version")
+        root = request.script_root
+        cached_version, shells = self._state
+        if version == cached_version and root in shells:
+            return shells[root]
+        with self._lock:
+            cached_version, shells = self._state
+            if version != cached_version:
+                shells = {}
+                self._state = (version, shells)
+            parts = shells.get(root)
+            if parts is None:
+                parts = self._render(metrics)
+                if len(shells) < self.MAX_ROOTS:
+                    shells[root] = parts
+            return parts
+
+    def index(self, metrics, **form_context):
+        head, tail = self._shells(metrics)[0]
+        return head + INDEX_FORM.render(**form_context) + tail
+
+    def dashboard(self, metrics, traffic=None):
+        head, tail = self._shells(metrics)[1]
+        return head + TRAFFIC_BLOCK.render(traffic=traffic) + tail
+
+
+PAGE_CACHE = PageCache()
+
 
 # -------------------------------------------------
-# 5. Routes
+# 5. Instrumentation (Prometheus text format)
+# -------------------------------------------------
+
+# Telemetry and LiveCounters live in telemetry.py, PredictionLog in
+# prediction_log.py.
+
+TELEMETRY = Telemetry()
+LIVE_COUNTERS = LiveCounters()
+
+# Persistent record of live predictions in a local SQLite file
+# (EMAIL_INTENT_LOG_DB), with hourly per-intent rollups for the dashboard.
+PREDICTION_LOG = PredictionLog(os.environ["EMAIL_INTENT_LOG_DB"]) if os.environ.get("EMAIL_INTENT_LOG_DB") else None
+
+
+@app.before_request
+def count_request():
+    TELEMETRY.inc("email_intent_requests_total",
+                  (("route", request.endpoint or "unknown"), ("method", request.method)))
+
+
+@app.before_request
+def ensure_rules_watcher():
+    # Prefork servers import the app in the master, where a watcher thread
+    # would not survive the fork: each worker starts its own on its first
+    # request.
+    if _rules_watcher_pid != os.getpid():
+        start_rules_watcher()
+
+
+def record_prediction(intent, matched_keywords, keyword_ids=None, text=None, latency=None, log=False):
+    """
+    Count a prediction. `latency` (seconds) feeds the live dashboard
+    counters; with `log` the prediction also goes to the prediction log,
+    if enabled, which only keeps the classifier page's predictions.
+    """
+    TELEMETRY.inc("email_intent_predictions_total", (("intent", intent),))
+    for keyword in matched_keywords:
+        TELEMETRY.inc("email_intent_keyword_hits_total", (("keyword", keyword),))
+    if latency is not None:
+        LIVE_COUNTERS.record(intent, latency)
+    prediction_log = PREDICTION_LOG
+    if log and prediction_log is not None and latency is not None:
+        text_hash = ClassificationCache.key(raw_window(text)).hex() if text is not None else None
+        prediction_log.append(intent, keyword_ids or (), text_hash, latency)
+
+
+
+# -------------------------------------------------
+# 6. Routes
 # -------------------------------------------------
 
 @app.route("/", methods=["GET", "POST"])
@@ -856,32 +2446,604 @@ def index():
     matched_category = None
     matched_keywords = []
     email_text = ""
+    scanned_chars = None
 
     if request.method == "POST":
-        email_text = request.form.get("email_text", "")
-        if email_text.strip():
-            predicted_intent, matched_category, matched_keywords = classify_email(email_text)
-
-    return render_template_string(
-        INDEX_TEMPLATE,
-        css=BASE_CSS,
-        predicted_intent=predicted_intent,
-        matched_category=matched_category,
-        matched_keywords=matched_keywords,
-        email_text=email_text,
-        metrics=METRICS,
-    )
+        with TELEMETRY.timer("email_intent_stage_seconds", (("stage", "parse"),)):
+            email_text = request.form.get("email_text", "")
+            upload = request.files.get("email_file")
+
+        start = time.perf_counter()
+        if upload and upload.filename:
+            # Uploaded files are scanned straight from the upload stream.
+            with TELEMETRY.timer("email_intent_stage_seconds", (("stage", "classify"),)):
+                if upload.filename.lower().endswith(".eml") or upload.mimetype == "message/rfc822":
+                    result = classify_message_stream(upload.stream)
+                else:
+                    result = classify_stream(upload.stream)
+            predicted_intent, matched_category = result["intent"], result["category"]
+            matched_keywords = result["matched_keywords"]
+            if result["truncated"]:
+                scanned_chars = result["scanned_chars"]
+            record_prediction(predicted_intent, matched_keywords, result["keyword_ids"],
+                              latency=time.perf_counter() - start, log=True)
+        elif email_text.strip():
+            with TELEMETRY.timer("email_intent_stage_seconds", (("stage", "classify"),)):
+                rules = get_rules()
+                text = prepare_text(email_text)
+                result = match_result(rules, *match_email(text, rules))
+            predicted_intent, matched_category = result["intent"], result["category"]
+            matched_keywords = result["matched_keywords"]
+            if exceeds_scan_budget(text):
+                scanned_chars = SCAN_BUDGET
+            record_prediction(predicted_intent, matched_keywords, result["keyword_ids"], text,
+                              latency=time.perf_counter() - start, log=True)
+            maybe_profile(text)
+            maybe_shadow(text, predicted_intent)
+
+    with TELEMETRY.timer("email_intent_stage_seconds", (("stage", "render"),)):
+        return PAGE_CACHE.index(
+            METRICS_CACHE.get(),
+            predicted_intent=predicted_intent,
+            matched_category=matched_category,
+            matched_keywords=matched_keywords,
+            email_text=email_text,
+            scanned_chars=scanned_chars,
+        )
 
 
 @app.route("/dashboard")
 def dashboard():
-    metrics = evaluate_classifier()
-    return render_template_string(
-        DASHBOARD_TEMPLATE,
-        css=BASE_CSS,
-        metrics=metrics,
+    with TELEMETRY.timer("email_intent_stage_seconds", (("stage", "render"),)):
+        traffic = PREDICTION_LOG.traffic() if PREDICTION_LOG is not None else None
+        return PAGE_CACHE.dashboard(METRICS_CACHE.get(), traffic=traffic)
+
+
+LIVE_PUSH_INTERVAL = float(os.environ.get("EMAIL_INTENT_LIVE_INTERVAL", "1.0"))
+# An empty event is sent after this many quiet seconds to keep proxies from
+# closing the stream.
+LIVE_HEARTBEAT_SECONDS = 15
+LIVE_STREAM_PREAMBLE = "retry: 5000\n"
+
+
+def live_event(buckets):
+    """
+    One Server-Sent Events message carrying `buckets` from LIVE_COUNTERS.
+    Shared with asgi.py, which serves the stream without a thread.
+    """
+    payload = {"bucket_seconds": LIVE_COUNTERS.bucket_seconds,
+               "window": LIVE_COUNTERS.size, "buckets": buckets}
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+@app.route("/dashboard/stream")
+def dashboard_stream():
+    """
+    Server-Sent Events feed for the live dashboard chart: the current window
+    first, then only the buckets that changed, at most once per interval.
+    """
+    def events():
+        seq, buckets = LIVE_COUNTERS.changes()
+        idle = 0.0
+        yield LIVE_STREAM_PREAMBLE
+        while True:
+            if buckets or idle >= LIVE_HEARTBEAT_SECONDS:
+                yield live_event(buckets)
+                idle = 0.0
+            time.sleep(LIVE_PUSH_INTERVAL)
+            idle += LIVE_PUSH_INTERVAL
+            seq, buckets = LIVE_COUNTERS.changes(seq)
+
+    response = app.response_class(events(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    rules = get_rules()
+    extra = [("email_intent_rules_info", "gauge", (("version", rules.version),), 1)]
+    if RESULT_CACHE is not None:
+        stats = RESULT_CACHE.stats()
+        extra += [
+            ("email_intent_cache_hits_total", "counter", (), stats["hits"]),
+            ("email_intent_cache_misses_total", "counter", (), stats["misses"]),
+            ("email_intent_cache_evictions_total", "counter", (), stats["evictions"]),
+            ("email_intent_cache_entries", "gauge", (), stats["size"]),
+        ]
+    return app.response_class(TELEMETRY.render(extra), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/assets/app.css")
+def stylesheet():
+    response = app.response_class(BASE_CSS, mimetype="text/css")
+    response.set_etag(CSS_VERSION)
+    if request.args.get("v") == CSS_VERSION:
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+
+# -------------------------------------------------
+# 7. JSON API
+# -------------------------------------------------
+
+MAX_BATCH_SIZE = int(os.environ.get("EMAIL_INTENT_MAX_BATCH", "10000"))
+
+
+class APIError(Exception):
+    """
+    A client error raised by the request handlers below, with its HTTP status.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _api_error(message, status=400):
+    return jsonify(error=message), status
+
+
+def _api_options(payload):
+    """
+    Validate the shared request options: "format" (auto, text, rfc822),
+    "mode" (first_match, score) and "multi_label_ratio" for score mode.
+    """
+    fmt = payload.get("format", "auto")
+    if fmt not in ("auto", "text", "rfc822"):
+        raise ValueError("'format' must be one of auto, text, rfc822")
+    mode = payload.get("mode", "first_match")
+    if mode not in ("first_match", "score"):
+        raise ValueError("'mode' must be one of first_match, score")
+    ratio = payload.get("multi_label_ratio", 0.5)
+    if not isinstance(ratio, (int, float)) or isinstance(ratio, bool) or not 0 < ratio <= 1:
+        raise ValueError("'multi_label_ratio' must be a number in (0, 1]")
+    return fmt, mode, ratio
+
+
+@app.route("/api/rules")
+def api_rules():
+    rules = get_rules()
+    return jsonify(
+        rules_version=rules.version,
+        default_intent=rules.default_intent,
+        intents=list(rules.intents),
+        keywords=list(rules.keywords),
     )
 
 
+def classify_api_request(payload):
+    """
+    Response body for a decoded /api/classify request; raises APIError.
+    Kept free of the request object so other servers (asgi.py) can call it.
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get("text"), str):
+        raise APIError("expected a JSON object with a 'text' string")
+
+    try:
+        fmt, mode, ratio = _api_options(payload)
+    except ValueError as exc:
+        raise APIError(str(exc)) from None
+
+    rules = get_rules()
+    start = time.perf_counter()
+    with TELEMETRY.timer("email_intent_stage_seconds", (("stage", "parse"),)):
+        text = prepare_text(payload["text"], fmt)
+
+    if mode == "score":
+        with TELEMETRY.timer("email_intent_stage_seconds", (("stage", "classify"),)):
+            result = score_email(text, rules, ratio)
+        record_prediction(result["intent"], (), latency=time.perf_counter() - start)
+        maybe_profile(text)
+        return dict(rules_version=rules.version, truncated=exceeds_scan_budget(text), **result)
+
+    with TELEMETRY.timer("email_intent_stage_seconds", (("stage", "classify"),)):
+        result = match_result(rules, *match_email(text, rules))
+    record_prediction(result["intent"], result["matched_keywords"], latency=time.perf_counter() - start)
+    maybe_profile(text)
+    maybe_shadow(text, result["intent"])
+    truncated = exceeds_scan_budget(text)
+    return dict(rules_version=rules.version, scanned_chars=SCAN_BUDGET if truncated else len(text),
+                truncated=truncated, **result)
+
+
+@app.route("/api/classify", methods=["POST"])
+def api_classify():
+    try:
+        return jsonify(classify_api_request(request.get_json(silent=True)))
+    except APIError as exc:
+        return _api_error(str(exc), exc.status)
+
+
+@app.route("/api/classify/stream", methods=["POST"])
+def api_classify_stream():
+    """
+    Classify a raw request body without buffering it: plain text is read in
+    chunks until it ends or the scan budget is reached; a message/rfc822
+    body is parsed (up to MAX_MESSAGE_BYTES) and only its new text scanned.
+    """
+    rules = get_rules()
+    start = time.perf_counter()
+    with TELEMETRY.timer("email_intent_stage_seconds", (("stage", "classify"),)):
+        if request.mimetype == "message/rfc822":
+            result = classify_message_stream(request.stream, rules)
+        else:
+            result = classify_stream(request.stream, rules)
+    record_prediction(result["intent"], result["matched_keywords"], latency=time.perf_counter() - start)
+    return jsonify(rules_version=rules.version, **result)
+
+
+def classify_batch_api_request(payload):
+    """
+    Response body for a decoded /api/classify/batch request; raises APIError.
+    Accepts {"emails": [text, ...]} or {"emails": [{"id": ..., "text": ...}, ...]}
+    and returns one compact result per email, in order. Keyword ids index
+    into the keyword list served by /api/rules for the same rules_version.
+    With "mode": "score" the whole batch is scored with score_batch().
+    """
+    emails = payload.get("emails") if isinstance(payload, dict) else None
+    if not isinstance(emails, list):
+        raise APIError("expected a JSON object with an 'emails' list")
+    if len(emails) > MAX_BATCH_SIZE:
+        raise APIError(f"batch too large: {len(emails)} emails (max {MAX_BATCH_SIZE})", 413)
+
+    try:
+        fmt, mode, ratio = _api_options(payload)
+    except ValueError as exc:
+        raise APIError(str(exc)) from None
+
+    # Emails in a batch are classified together, so each is credited with
+    # an equal share of the batch's time on the live dashboard.
+    start = time.perf_counter()
+    ids = []
+    texts = []
+    for position, item in enumerate(emails):
+        if isinstance(item, str):
+            email_id, text = position, item
+        elif isinstance(item, dict) and isinstance(item.get("text"), str):
+            email_id, text = item.get("id", position), item["text"]
+        else:
+            raise APIError(f"email #{position} must be a string or an object with a 'text' string")
+        ids.append(email_id)
+        texts.append(prepare_text(text, fmt))
+
+    rules = get_rules()
+    for text in texts:
+        maybe_profile(text)
+    if mode == "score":
+        with TELEMETRY.timer("email_intent_stage_seconds", (("stage", "classify"),)):
+            scored = score_batch(texts, rules, ratio)
+        results = []
+        latency = (time.perf_counter() - start) / max(len(scored), 1)
+        for email_id, result in zip(ids, scored):
+            record_prediction(result["intent"], (), latency=latency)
+            results.append({"id": email_id, **result})
+        return dict(rules_version=rules.version, results=results)
+
+    results = []
+    unmatched = []
+    for email_id, text in zip(ids, texts):
+        with TELEMETRY.timer("email_intent_stage_seconds", (("stage", "classify"),)):
+            intent, _category, keyword_ids = match_email(text, rules, fallback=False)
+        result = {"id": email_id, "intent": intent, "keyword_ids": keyword_ids}
+        if exceeds_scan_budget(text):
+            result["truncated"] = True
+        if not keyword_ids:
+            unmatched.append((result, text))
+        results.append(result)
+
+    model = FALLBACK_MODEL
+    if model is not None and unmatched:
+        # Emails no rule matched go through the fallback model in one batch.
+        predictions = model.predict_batch([scan_window(text) for _, text in unmatched])
+        for (result, _), prediction in zip(unmatched, predictions):
+            result["intent"], category = model.fallback(prediction, rules.default_intent)
+            if category == FALLBACK_CATEGORY:
+                result["model"] = True
+
+    latency = (time.perf_counter() - start) / max(len(results), 1)
+    for result, text in zip(results, texts):
+        record_prediction(result["intent"], [rules.keywords[kid] for kid in result["keyword_ids"]],
+                          latency=latency)
+        maybe_shadow(text, result["intent"])
+
+    return dict(rules_version=rules.version, results=results)
+
+
+@app.route("/api/classify/batch", methods=["POST"])
+def api_classify_batch():
+    """
+    Classify many emails in one request (see classify_batch_api_request).
+    """
+    try:
+        return jsonify(classify_batch_api_request(request.get_json(silent=True)))
+    except APIError as exc:
+        return _api_error(str(exc), exc.status)
+
+
+@app.route("/api/cache")
+def api_cache_stats():
+    if RESULT_CACHE is None:
+        return jsonify(enabled=False)
+    return jsonify(enabled=True, **RESULT_CACHE.stats())
+
+
+@app.route("/api/profile")
+def api_profile():
+    profiler = _live_profiler
+    if not PROFILE_SAMPLE_RATE:
+        return jsonify(enabled=False)
+    if profiler is None or profiler.rules is not get_rules():
+        return jsonify(enabled=True, sample_rate=PROFILE_SAMPLE_RATE, emails=0)
+    return jsonify(enabled=True, sample_rate=PROFILE_SAMPLE_RATE, **profiler.report())
+
+
+def _admin_authorized():
+    token = os.environ.get("EMAIL_INTENT_ADMIN_TOKEN")
+    return bool(token) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token)
+
+
+@app.route("/admin/reload-rules", methods=["POST"])
+def admin_reload_rules():
+    if not _admin_authorized():
+        return jsonify(error="forbidden"), 403
+
+    try:
+        rules = reload_rules()
+    except (OSError, ValueError) as exc:
+        return jsonify(error=f"rules not reloaded: {exc}", version=get_rules().version), 400
+
+    # Only this process has swapped its rules. Bumping the file's mtime
+    # makes the watchers of the other workers reload it as well.
+    try:
+        os.utime(rules.source)
+        touched = True
+    except (OSError, TypeError):
+        touched = False
+    watching = float(os.environ.get("EMAIL_INTENT_RULES_WATCH", "0") or 0) > 0
+    return jsonify(version=rules.version, source=rules.source, propagated=touched and watching,
+                   intents=list(rules.intents), keywords=len(rules.keywords))
+
+
+@app.route("/admin/shadow", methods=["GET", "POST", "DELETE"])
+def admin_shadow():
+    """
+    GET: report of the running shadow evaluation.
+    POST: start shadowing a candidate, given inline as {"rules": {...}} (the
+    rules.json format) or as {"path": "candidate.json"}, with an optional
+    "sample_rate"; replaces any running candidate.
+    DELETE: stop shadowing and return the final report.
+    """
+    global _shadow
+    if not _admin_authorized():
+        return jsonify(error="forbidden"), 403
+
+    if request.method == "GET":
+        shadow = _shadow
+        if shadow is None:
+            return jsonify(enabled=False)
+        return jsonify(enabled=True, active_version=get_rules().version, **shadow.report())
+
+    if request.method == "DELETE":
+        shadow, _shadow = _shadow, None
+        if shadow is None:
+            return jsonify(enabled=False)
+        shadow.stop()
+        return jsonify(enabled=False, active_version=get_rules().version, **shadow.report())
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return _api_error("expected a JSON object with 'rules' or 'path'")
+    sample_rate = payload.get("sample_rate", SHADOW_SAMPLE_RATE)
+    if not isinstance(sample_rate, (int, float)) or isinstance(sample_rate, bool) or not 0 < sample_rate <= 1:
+        return _api_error("'sample_rate' must be a number in (0, 1]")
+    try:
+        if isinstance(payload.get("path"), str):
+            candidate = load_rules(payload["path"])
+        else:
+            candidate = parse_rules(payload.get("rules"), source="inline")
+    except (OSError, ValueError) as exc:
+        return _api_error(f"candidate rules rejected: {exc}")
+
+    # The result cache only holds entries for the active rules, so the
+    # candidate bypasses it.
+    shadow, _shadow = _shadow, ShadowEvaluator(candidate, match_uncached, sample_rate)
+    if shadow is not None:
+        shadow.stop()
+    return jsonify(enabled=True, active_version=get_rules().version, **_shadow.report())
+
+
+# -------------------------------------------------
+# 8. Command line
+# -------------------------------------------------
+
+def iter_input_records(stream, fmt="auto", text_field="text"):
+    """
+    Yield (id, text) pairs from a text stream, one email per line.
+    JSONL lines are objects holding the email in `text_field` (and an
+    optional "id"); plain-text lines are the email itself. Lines that cannot
+    be read yield (id, ValueError) so the caller can report them in order.
+    """
+    for line_no, line in enumerate(stream, 1):
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            continue
+        if fmt == "text" or (fmt == "auto" and not line.lstrip().startswith("{")):
+            yield line_no, line
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield line_no, ValueError(f"invalid JSON: {exc}")
+            continue
+        if not isinstance(record, dict) or not isinstance(record.get(text_field), str):
+            yield line_no, ValueError(f"missing '{text_field}' string")
+            continue
+        yield record.get("id", line_no), record[text_field]
+
+
+def classify_records(records, message_format="text", profiler=None):
+    for email_id, text in records:
+        if isinstance(text, ValueError):
+            yield {"id": email_id, "error": str(text)}
+            continue
+        text = prepare_text(text, message_format)
+        if profiler is not None:
+            profiler.record(scan_window(text))
+        rules = get_rules()
+        yield {"id": email_id, **match_result(rules, *match_email(text, rules))}
+
+
+def write_jsonl(results, out):
+    count = 0
+    for result in results:
+        out.write(json.dumps(result, ensure_ascii=False))
+        out.write("\n")
+        count += 1
+    return count
+
+
+def _open_input(path):
+    if path == "-":
+        return sys.stdin
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def run_classify_command(args):
+    profiler = RuleProfiler(get_rules()) if args.profile else None
+    stream = _open_input(args.input)
+    try:
+        records = iter_input_records(stream, args.format, args.text_field)
+        write_jsonl(classify_records(records, args.messages, profiler), sys.stdout)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+    if profiler is not None:
+        with open(args.profile, "w", encoding="utf-8") as fh:
+            json.dump(profiler.report(), fh, indent=2)
+    return 0
+
+
+def run_archive_command(args):
+    import archive  # archive.py imports this module, so it is loaded on demand
+
+    counts = Counter()
+    total = write_jsonl(archive.classify_archive(args.path, args.workers, args.chunk_size, counts, args.rules),
+                        sys.stdout)
+    summary = {"messages": total, "intents": dict(counts.most_common())}
+    print(json.dumps(summary), file=sys.stderr)
+    return 0
+
+
+def run_evaluate_command(args):
+    def report(rows):
+        print(f"evaluated {rows} emails...", file=sys.stderr, flush=True)
+
+    rules = load_rules(args.rules) if args.rules else get_rules()
+    metrics = evaluate_classifier(rules, args.dataset, progress=report, progress_every=args.progress_every)
+    metrics["rules_version"] = rules.version
+    print(json.dumps(metrics, indent=2))
+    return 0
+
+
+def run_train_command(args):
+    def report(epoch, rows):
+        print(f"epoch {epoch}: {rows} training rows so far", file=sys.stderr, flush=True)
+
+    rules = load_rules(args.rules) if args.rules else get_rules()
+    model = train_fallback_model(args.dataset, rules, 2 ** args.hash_bits, args.epochs,
+                                 args.learning_rate, args.all_rows, report)
+    model.save(args.out)
+    print(json.dumps({"model": args.out, "version": model.version, "labels": list(model.labels),
+                      "n_features": model.n_features}))
+    return 0
+
+
+def create_app(warm=True):
+    """
+    App factory for production servers. With `warm`, everything that is
+    built once (rules, the metrics snapshot) is built now, so a prefork
+    server that imports this in its master process (gunicorn --preload)
+    hands it to every worker copy-on-write. The heap is then frozen so the
+    garbage collector does not touch, and thereby copy, those objects in
+    the workers. Page shells are not pre-rendered: their links depend on
+    the prefix of the request, so they are rendered on first use, and the
+    rule-file watcher (EMAIL_INTENT_RULES_WATCH) is started by each worker
+    on its first request.
+    """
+    if warm:
+        get_rules()
+        METRICS_CACHE.get(wait=True)
+        gc.freeze()
+    return app
+
+
+def run_serve_command(args):
+    start_rules_watcher()
+    app.run(host=args.host, port=args.port, debug=not args.no_debug)
+    return 0
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Email Intent Intelligence - rule-based email classifier")
+    commands = parser.add_subparsers(dest="command")
+
+    serve = commands.add_parser("serve", help="run the web app (default)")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=5000)
+    serve.add_argument("--no-debug", action="store_true", help="disable the Flask debugger and reloader")
+    serve.set_defaults(handler=run_serve_command)
+
+    classify = commands.add_parser("classify", help="classify emails from JSONL or text, write JSONL to stdout")
+    classify.add_argument("input", nargs="?", default="-", help="input file, or - for stdin (default)")
+    classify.add_argument("--format", choices=["auto", "jsonl", "text"], default="auto",
+                          help="jsonl: one JSON object per line; text: one email per line; auto: detect per line")
+    classify.add_argument("--text-field", default="text", help="JSONL field holding the email text")
+    classify.add_argument("--profile", metavar="REPORT.json", default=None,
+                          help="also profile keyword hits and scan cost, and write the report here")
+    classify.add_argument("--messages", choices=["text", "rfc822", "auto"], default="text",
+                          help="rfc822: texts are raw messages to preprocess; auto: detect mail headers")
+    classify.set_defaults(handler=run_classify_command)
+
+    archive = commands.add_parser("archive", help="classify an mbox file or Maildir directory with a process pool")
+    archive.add_argument("path", help="mbox file or Maildir directory")
+    archive.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    archive.add_argument("--chunk-size", type=int, default=200, help="messages sent to a worker at a time")
+    archive.add_argument("--rules", default=None, help="rule file to use (default: active rules)")
+    archive.set_defaults(handler=run_archive_command)
+
+    evaluate = commands.add_parser("evaluate", help="score the rules against a labelled dataset")
+    evaluate.add_argument("dataset", nargs="?", default=None,
+                          help=".csv / .jsonl file or directory of .eml files with labels.csv (default: built-in set)")
+    evaluate.add_argument("--rules", default=None, help="rule file to evaluate (default: active rules)")
+    evaluate.add_argument("--progress-every", type=int, default=100000, help="report progress every N emails")
+    evaluate.set_defaults(handler=run_evaluate_command)
+
+    train = commands.add_parser("train", help="train the hashed-feature fallback model (needs NumPy)")
+    train.add_argument("dataset", help="labelled .csv / .jsonl file or .eml directory")
+    train.add_argument("--out", default="fallback_model.npz", help="where to write the model")
+    train.add_argument("--hash-bits", type=int, default=18, help="log2 of the number of hashed features")
+    train.add_argument("--epochs", type=int, default=5)
+    train.add_argument("--learning-rate", type=float, default=0.2)
+    train.add_argument("--all-rows", action="store_true",
+                       help="train on every row, not only rows where no rule fires")
+    train.add_argument("--rules", default=None, help="rule file deciding which rows no rule covers")
+    train.set_defaults(handler=run_train_command)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args = parser.parse_args(["serve"])
+    return args.handler(args)
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
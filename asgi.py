@@ -0,0 +1,394 @@
+"""
+ASGI entry point for the email intent classifier.
+
+The JSON classification endpoints are served by async handlers: the
+request body is read on the event loop and the CPU-bound classification
+runs on a bounded thread pool, so thousands of slow clients only cost
+pending coroutines, not threads. The live dashboard's event stream is
+served natively too, polling the in-memory counters between
+asyncio.sleep() calls, so an open dashboard costs no thread. Every other
+path (all finite responses) is handed to the Flask app through a small
+WSGI bridge that runs requests concurrently on a thread pool and feeds
+the request body to the app as it reads it.
+
+    uvicorn asgi:application --workers 4
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker -w 4 --preload
+"""
+
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import app_full
+
+# Built at import time, i.e. in the master process under --preload.
+flask_app = app_full.create_app()
+
+CLASSIFY_THREADS = int(os.environ.get("EMAIL_INTENT_ASGI_THREADS", str(os.cpu_count() or 4)))
+# Requests waiting for a classification thread before new ones get a 503.
+MAX_PENDING = int(os.environ.get("EMAIL_INTENT_ASGI_MAX_PENDING", "1024"))
+# Largest JSON body accepted by the async handlers.
+MAX_BODY_BYTES = int(os.environ.get("EMAIL_INTENT_ASGI_MAX_BODY", str(32 * 1024 * 1024)))
+WSGI_THREADS = int(os.environ.get("EMAIL_INTENT_ASGI_WSGI_THREADS", "32"))
+
+# path -> (Flask endpoint name, for the request counter; handler)
+HANDLERS = {
+    "/api/classify": ("api_classify", app_full.classify_api_request),
+    "/api/classify/batch": ("api_classify_batch", app_full.classify_batch_api_request),
+}
+
+
+class _Worker:
+    """
+    Per-process state, created on first use (after any fork) because
+    threads and event-loop objects don't survive fork().
+    """
+
+    def __init__(self):
+        self.classify_pool = ThreadPoolExecutor(CLASSIFY_THREADS, thread_name_prefix="classify")
+        self.wsgi_pool = ThreadPoolExecutor(WSGI_THREADS, thread_name_prefix="wsgi")
+        self.slots = asyncio.Semaphore(CLASSIFY_THREADS + MAX_PENDING)
+        self.rules_watcher = app_full.start_rules_watcher()
+
+    def shutdown(self):
+        if self.rules_watcher is not None:
+            self.rules_watcher.stop()
+        self.classify_pool.shutdown(wait=False)
+        self.wsgi_pool.shutdown(wait=False)
+
+
+_worker = None
+
+
+def _get_worker():
+    global _worker
+    if _worker is None:
+        _worker = _Worker()
+    return _worker
+
+
+async def _send_json(send, status, body, headers=()):
+    data = json.dumps(body).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(data)).encode("ascii")), *headers],
+    })
+    await send({"type": "http.response.body", "body": data})
+
+
+async def _read_body(receive, limit=None):
+    """
+    The whole request body, or None if it exceeds `limit` bytes or the
+    client went away.
+    """
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+def _count_request(endpoint, method):
+    # Same counter as app_full.count_request(), which only runs for
+    # requests that reach Flask.
+    app_full.TELEMETRY.inc("email_intent_requests_total", (("route", endpoint), ("method", method)))
+
+
+def _handle(handler, body):
+    # Runs on the classification pool: large JSON bodies are parsed there too.
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        payload = None
+    return handler(payload)
+
+
+async def _classify(scope, receive, send, endpoint, handler):
+    _count_request(endpoint if scope["method"] == "POST" else "unknown", scope["method"])
+    if scope["method"] != "POST":
+        await _send_json(send, 405, {"error": "method not allowed"}, [(b"allow", b"POST")])
+        return
+
+    # Slow uploads are awaited on the loop without holding a thread or slot.
+    body = await _read_body(receive, MAX_BODY_BYTES)
+    if body is None:
+        await _send_json(send, 413, {"error": f"request body larger than {MAX_BODY_BYTES} bytes"})
+        return
+
+    worker = _get_worker()
+    if worker.slots.locked():
+        # Shed load instead of queueing without bound.
+        await _send_json(send, 503, {"error": "server busy, retry later"}, [(b"retry-after", b"1")])
+        return
+
+    async with worker.slots:
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(worker.classify_pool, _handle, handler, body)
+        except app_full.APIError as exc:
+            await _send_json(send, exc.status, {"error": str(exc)})
+            return
+    await _send_json(send, 200, result)
+
+
+async def _watch_disconnect(receive, disconnected):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+    disconnected.set()
+
+
+async def _dashboard_stream(scope, receive, send):
+    """
+    /dashboard/stream without the Flask app: same events as
+    app_full.dashboard_stream(), until the client disconnects.
+    """
+    _count_request("dashboard_stream" if scope["method"] == "GET" else "unknown", scope["method"])
+    if scope["method"] != "GET":
+        await _send_json(send, 405, {"error": "method not allowed"}, [(b"allow", b"GET")])
+        return
+
+    disconnected = asyncio.Event()
+    watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+    counters = app_full.LIVE_COUNTERS
+    interval = app_full.LIVE_PUSH_INTERVAL
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                        (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")],
+        })
+        await send({"type": "http.response.body", "body": app_full.LIVE_STREAM_PREAMBLE.encode("utf-8"),
+                    "more_body": True})
+        seq, buckets = counters.changes()
+        idle = 0.0
+        while not disconnected.is_set():
+            if buckets or idle >= app_full.LIVE_HEARTBEAT_SECONDS:
+                await send({"type": "http.response.body", "body": app_full.live_event(buckets).encode("utf-8"),
+                            "more_body": True})
+                idle = 0.0
+            await asyncio.sleep(interval)
+            idle += interval
+            seq, buckets = counters.changes(seq)
+    finally:
+        watcher.cancel()
+
+
+class _RequestBody(io.RawIOBase):
+    """
+    wsgi.input fed from receive() while the app reads it. A pump task on
+    the event loop holds at most one received chunk until the reading
+    thread takes it, so a large upload never sits in memory as a whole,
+    and it keeps listening for http.disconnect once the body is complete.
+    """
+
+    def __init__(self, receive):
+        self._receive = receive
+        self._loop = asyncio.get_running_loop()
+        self._cond = threading.Condition()
+        self._chunks = deque()
+        self._offset = 0
+        self._complete = False
+        self._draining = False
+        self._wanted = asyncio.Event()
+        self._wanted.set()
+        self.disconnected = asyncio.Event()
+        self._pump = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        try:
+            while True:
+                if not self._complete:
+                    await self._wanted.wait()
+                message = await self._receive()
+                if message["type"] == "http.disconnect":
+                    self.disconnected.set()
+                    return
+                if self._complete:
+                    continue
+                chunk = message.get("body", b"")
+                with self._cond:
+                    if chunk and not self._draining:
+                        self._chunks.append(chunk)
+                        self._wanted.clear()
+                    if not message.get("more_body", False):
+                        self._complete = True
+                    self._cond.notify_all()
+        finally:
+            self._finish()
+
+    def _finish(self):
+        with self._cond:
+            self._complete = True
+            self._cond.notify_all()
+
+    def drain(self):
+        """
+        The app has returned: discard whatever body it did not read, so the
+        pump can go on to notice a disconnect.
+        """
+        with self._cond:
+            self._draining = True
+            self._chunks.clear()
+        self._wanted.set()
+
+    def close_pump(self):
+        self._pump.cancel()
+        self._finish()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # Runs on a bridge thread.
+        with self._cond:
+            while not self._chunks and not self._complete:
+                self._cond.wait()
+            if not self._chunks:
+                return 0
+            chunk = self._chunks[0]
+            n = min(len(buffer), len(chunk) - self._offset)
+            buffer[:n] = chunk[self._offset:self._offset + n]
+            self._offset += n
+            if self._offset == len(chunk):
+                self._chunks.popleft()
+                self._offset = 0
+                if not self._chunks:
+                    self._loop.call_soon_threadsafe(self._wanted.set)
+            return n
+
+
+def _route_path(scope):
+    """
+    The request path below the mount point. ASGI servers include root_path
+    in scope["path"] (uvicorn since 0.26), older ones left it out, so the
+    prefix is removed once when it is there.
+    """
+    path, root = scope["path"], scope.get("root_path", "")
+    if root and (path == root or path.startswith(root + "/")):
+        return path[len(root):] or "/"
+    return path
+
+
+def _environ(scope, body):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": _route_path(scope).encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BufferedReader(body, app_full.STREAM_CHUNK_SIZE),
+        # Lets the app read a chunked body (no Content-Length) up to its end.
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+        elif name == "TRANSFER_ENCODING":
+            continue
+        else:
+            key = "HTTP_" + name
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _wsgi_bridge(scope, receive, send, pool):
+    """
+    Run the Flask app for one request on `pool`. The request body is read
+    as the app consumes it, the response is sent chunk by chunk and
+    iteration stops when the client disconnects. Each request holds a pool
+    thread until its response ends, so only finite responses should be
+    routed here.
+    """
+    body = _RequestBody(receive)
+    disconnected = body.disconnected
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+        return lambda data: None
+
+    loop = asyncio.get_running_loop()
+    try:
+        iterable = await loop.run_in_executor(pool, flask_app, _environ(scope, body), start_response)
+    except BaseException:
+        body.close_pump()
+        raise
+    body.drain()
+    try:
+        iterator = iter(iterable)
+        await send({"type": "http.response.start", "status": response["status"],
+                    "headers": response["headers"]})
+        while not disconnected.is_set():
+            chunk = await loop.run_in_executor(pool, next, iterator, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        body.close_pump()
+        close = getattr(iterable, "close", None)
+        if close is not None:
+            await loop.run_in_executor(pool, close)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            _get_worker()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _worker is not None:
+                _worker.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path = _route_path(scope)
+    route = HANDLERS.get(path)
+    if route is not None:
+        await _classify(scope, receive, send, *route)
+        return
+    if path == "/dashboard/stream":
+        # Long-lived: served on the loop instead of holding a bridge thread.
+        await _dashboard_stream(scope, receive, send)
+        return
+
+    await _wsgi_bridge(scope, receive, send, _get_worker().wsgi_pool)
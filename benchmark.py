@@ -0,0 +1,320 @@
+"""
+Benchmarks for the rule-based email intent classifier.
+
+Generates reproducible synthetic email corpora and measures throughput,
+per-call latency percentiles and memory allocations for classify_email,
+compute_metrics and page rendering. Results are written as JSON so runs
+can be compared across commits:
+
+    python benchmark.py --emails 2000 --seed 7 --json bench.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import app_full
+
+# Plain filler vocabulary; words that would trigger a rule are filtered out
+# against the active rules when the corpus is generated.
+FILLER_WORDS = (
+    "the", "team", "project", "update", "please", "thanks", "regards", "week",
+    "today", "report", "notes", "attached", "office", "quarter", "plan", "draft",
+    "review", "weekend", "family", "travel", "lunch", "idea", "question", "status",
+    "client", "numbers", "version", "feedback", "hope", "you", "are", "doing",
+    "fine", "and", "with", "for", "our", "new", "soon", "later", "again",
+)
+
+UNICODE_FILLER = (
+    "café", "naïve", "straße", "Ωμέγα", "日本語", "données", "çok", "ñandú",
+    "“quoted”", "it’s", "—", "🎉", "Привет", "ﬁnance",
+)
+
+BODY_LENGTHS = {
+    "short": (20, 60),
+    "medium": (200, 400),
+    "long": (2000, 4000),
+}
+
+
+def _filler(rules):
+    words = [w for w in FILLER_WORDS + UNICODE_FILLER if not rules.match(app_full.normalize_text(w))[2]]
+    plain = [w for w in words if w.isascii()]
+    return plain, [w for w in words if not w.isascii()]
+
+
+def generate_corpus(n, seed=0, body_words=(20, 60), keyword_density=0.02,
+                    intent_mix=None, unicode_ratio=0.05, rules=None):
+    """
+    Yield n (text, label) pairs. Emails of a rule intent contain at least one
+    of its keywords; `keyword_density` is the chance of any further word
+    being one. `unicode_ratio` is the chance of a word being non-ASCII filler,
+    for every label. `intent_mix` maps intent -> relative weight (uniform by
+    default).
+    """
+    rules = rules or app_full.get_rules()
+    rng = random.Random(seed)
+    plain, unicode_words = _filler(rules)
+
+    keywords_by_intent = {intent: [] for intent in rules.intents}
+    for keyword, rank in zip(rules.keywords, rules.keyword_ranks):
+        keywords_by_intent[rules.intents[rank]].append(keyword)
+
+    labels = list(rules.intents) + [rules.default_intent]
+    weights = [(intent_mix or {}).get(label, 1.0 if intent_mix is None else 0.0) for label in labels]
+
+    for _ in range(n):
+        label = rng.choices(labels, weights)[0]
+        keywords = keywords_by_intent.get(label)
+        words = []
+        for _ in range(rng.randint(*body_words)):
+            roll = rng.random()
+            if keywords and roll < keyword_density:
+                words.append(rng.choice(keywords))
+            elif unicode_words and keyword_density <= roll < keyword_density + unicode_ratio:
+                words.append(rng.choice(unicode_words))
+            else:
+                words.append(rng.choice(plain))
+        if keywords:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(keywords))
+        text = " ".join(words)
+        yield (text[0].upper() + text[1:]) if text else text, label
+
+
+def percentiles(samples_ns):
+    ordered = sorted(samples_ns)
+    if not ordered:
+        return {}
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] / 1000.0
+
+    return {
+        "p50_us": pick(0.50),
+        "p90_us": pick(0.90),
+        "p99_us": pick(0.99),
+        "max_us": ordered[-1] / 1000.0,
+        "mean_us": sum(ordered) / len(ordered) / 1000.0,
+    }
+
+
+def _timed_calls(func, items):
+    samples = []
+    clock = time.perf_counter_ns
+    for item in items:
+        start = clock()
+        func(item)
+        samples.append(clock() - start)
+    return samples
+
+
+def _allocations(func, items):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        for item in items:
+            func(item)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename") if stat.size_diff > 0)
+    return {"peak_bytes": peak, "retained_bytes": allocated}
+
+
+def bench_classifier(corpus, repeat=3):
+    """
+    classify_email over the corpus with the result cache disabled (cold)
+    and enabled after a warm-up pass (warm).
+    """
+    texts = [text for text, _ in corpus]
+    chars = sum(len(text) for text in texts)
+    cache = app_full.RESULT_CACHE
+    results = {}
+    try:
+        app_full.RESULT_CACHE = None
+        samples = []
+        for _ in range(repeat):
+            samples += _timed_calls(app_full.classify_email, texts)
+        total_s = sum(samples) / 1e9
+        results["cold"] = {
+            "calls": len(samples),
+            "emails_per_s": len(samples) / total_s if total_s else None,
+            "mb_per_s": chars * repeat / 1e6 / total_s if total_s else None,
+            **percentiles(samples),
+            **_allocations(app_full.classify_email, texts[:500]),
+        }
+
+        app_full.RESULT_CACHE = app_full.ClassificationCache(len(texts) + 1)
+        for text in texts:
+            app_full.classify_email(text)
+        samples = _timed_calls(app_full.classify_email, texts)
+        total_s = sum(samples) / 1e9
+        results["warm_cache"] = {
+            "calls": len(samples),
+            "emails_per_s": len(samples) / total_s if total_s else None,
+            **percentiles(samples),
+        }
+    finally:
+        app_full.RESULT_CACHE = cache
+
+    results["avg_chars"] = chars / len(texts) if texts else 0
+    return results
+
+
+def bench_metrics(corpus, repeat=5):
+    true_labels = [label for _, label in corpus]
+    pred_labels = [app_full.classify_email(text)[0] for text, _ in corpus]
+
+    def run(_):
+        app_full.compute_metrics(true_labels, pred_labels)
+
+    samples = _timed_calls(run, range(repeat))
+    return {
+        "rows": len(true_labels),
+        "rows_per_s": len(true_labels) * repeat / (sum(samples) / 1e9) if samples else None,
+        **percentiles(samples),
+        **_allocations(run, range(1)),
+    }
+
+
+def bench_render(corpus, repeat=200):
+    """
+    Render the index page (with a prediction) and the dashboard through
+    the Flask test client, so routing and response building are included.
+    """
+    client = app_full.app.test_client()
+    texts = [text for text, _ in corpus[:repeat]] or [""]
+    results = {}
+
+    def post_index(text):
+        client.post("/", data={"email_text": text})
+
+    def get_dashboard(_):
+        client.get("/dashboard")
+
+    samples = _timed_calls(post_index, texts)
+    response = client.post("/", data={"email_text": texts[0]})
+    results["index_post"] = {"calls": len(samples), "response_bytes": len(response.data), **percentiles(samples),
+                             **_allocations(post_index, texts[:50])}
+
+    samples = _timed_calls(get_dashboard, range(repeat))
+    response = client.get("/dashboard")
+    results["dashboard"] = {"calls": len(samples), "response_bytes": len(response.data), **percentiles(samples),
+                            **_allocations(get_dashboard, range(50))}
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=app_full.BASE_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def parse_intent_mix(spec, rules):
+    """
+    {"intent": weight} from "casual=3,request_invoice=1". Raises ValueError
+    for unknown intents, bad weights or a mix whose weights are all zero.
+    """
+    labels = set(rules.intents) | {rules.default_intent}
+    mix = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        intent, _, weight = item.partition("=")
+        intent = intent.strip()
+        if intent not in labels:
+            raise ValueError(f"unknown intent '{intent}' (known: {', '.join(sorted(labels))})")
+        try:
+            mix[intent] = float(weight)
+        except ValueError:
+            raise ValueError(f"intent '{intent}' needs a numeric weight, e.g. {intent}=1") from None
+        if mix[intent] < 0:
+            raise ValueError(f"intent '{intent}' has a negative weight")
+    if not any(mix.values()):
+        raise ValueError("the intent mix needs at least one positive weight")
+    return mix
+
+
+def run_benchmarks(emails=2000, seed=0, lengths=("short", "medium", "long"),
+                   keyword_density=0.02, unicode_ratio=0.05, intent_mix=None):
+    rules = app_full.get_rules()
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rules_version": rules.version,
+            "keywords": len(rules.keywords),
+            "emails": emails,
+            "seed": seed,
+            "keyword_density": keyword_density,
+            "unicode_ratio": unicode_ratio,
+            "intent_mix": intent_mix,
+        },
+        "classifier": {},
+    }
+
+    for length in lengths:
+        corpus = list(generate_corpus(emails, seed, BODY_LENGTHS[length], keyword_density,
+                                      intent_mix, unicode_ratio, rules))
+        report["classifier"][length] = bench_classifier(corpus)
+
+    corpus = list(generate_corpus(max(emails, 10000), seed, BODY_LENGTHS["short"], keyword_density,
+                                  intent_mix, unicode_ratio, rules))
+    report["metrics"] = bench_metrics(corpus)
+    report["render"] = bench_render(corpus)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the email intent classifier")
+    parser.add_argument("--emails", type=int, default=2000, help="emails per corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lengths", default="short,medium,long",
+                        help="comma-separated body lengths: " + ", ".join(BODY_LENGTHS))
+    parser.add_argument("--keyword-density", type=float, default=0.02)
+    parser.add_argument("--unicode-ratio", type=float, default=0.05)
+    parser.add_argument("--intent-mix", default=None, metavar="INTENT=W,...",
+                        help="relative share of each label, e.g. casual=3,request_invoice=1 (default: uniform)")
+    parser.add_argument("--json", default="-", help="write the JSON report here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    lengths = [name.strip() for name in args.lengths.split(",") if name.strip()]
+    unknown = set(lengths) - set(BODY_LENGTHS)
+    if unknown:
+        parser.error(f"unknown length(s): {', '.join(sorted(unknown))}")
+
+    intent_mix = None
+    if args.intent_mix is not None:
+        try:
+            intent_mix = parse_intent_mix(args.intent_mix, app_full.get_rules())
+        except ValueError as exc:
+            parser.error(f"--intent-mix: {exc}")
+
+    report = run_benchmarks(args.emails, args.seed, lengths, args.keyword_density, args.unicode_ratio,
+                            intent_mix)
+    output = json.dumps(report, indent=2)
+    if args.json == "-":
+        print(output)
+    else:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            fh.write(output + "\n")
+
+    for length, result in report["classifier"].items():
+        cold = result["cold"]
+        print(f"classify_email [{length}]: {cold['emails_per_s']:.0f} emails/s, "
+              f"p50 {cold['p50_us']:.1f} us, p99 {cold['p99_us']:.1f} us", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+Fallback model for the email intent classifier.
+
+An optional hashed-feature linear model, consulted only when no rule
+fires. Tokens and token bigrams are hashed (crc32) into a fixed number of
+buckets, so no vocabulary is kept; the model is one NumPy weight array
+saved as an .npz file:
+
+    python app_full.py train labelled.jsonl --out fallback_model.npz
+    EMAIL_INTENT_MODEL=fallback_model.npz python app_full.py serve
+"""
+
+import hashlib
+import logging
+import os
+import re
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; without it no model is loaded or trained
+    np = None
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"\w+")
+
+FALLBACK_CATEGORY = "fallback_model"
+
+
+def hashed_features(text, n_features):
+    """
+    Sorted unique feature indices for lowercased text (unigrams + bigrams).
+    """
+    tokens = _TOKEN.findall(text)
+    grams = tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]
+    return sorted({zlib.crc32(gram.encode("utf-8")) % n_features for gram in grams})
+
+
+class HashedFeatureStream:
+    """
+    hashed_features() for text fed in chunks: a token running into the end
+    of a chunk is carried over, and the last complete token is kept for
+    the next bigram, so the result is the same as for the joined text.
+    """
+
+    def __init__(self, n_features):
+        self.n_features = n_features
+        self._features = set()
+        self._carry = ""
+        self._last = None
+
+    def _add(self, token):
+        n = self.n_features
+        self._features.add(zlib.crc32(token.encode("utf-8")) % n)
+        if self._last is not None:
+            self._features.add(zlib.crc32(f"{self._last} {token}".encode("utf-8")) % n)
+        self._last = token
+
+    def feed(self, text):
+        text = self._carry + text
+        self._carry = ""
+        for match in _TOKEN.finditer(text):
+            if match.end() == len(text):
+                self._carry = match.group()
+            else:
+                self._add(match.group())
+
+    def indices(self):
+        if self._carry:
+            self._add(self._carry)
+            self._carry = ""
+        return sorted(self._features)
+
+
+class HashedLinearModel:
+    """
+    Multinomial logistic regression over hashed features.
+    `weights` has shape (n_features, len(labels)); `bias` has len(labels).
+    """
+
+    def __init__(self, labels, weights, bias, min_confidence=0.5):
+        self.labels = tuple(labels)
+        self.weights = weights
+        self.bias = bias
+        self.n_features = weights.shape[0]
+        self.min_confidence = min_confidence
+        self.version = hashlib.sha1(weights.tobytes() + bias.tobytes()).hexdigest()[:12]
+
+    @classmethod
+    def zeros(cls, labels, n_features):
+        return cls(labels, np.zeros((n_features, len(labels)), dtype=np.float32),
+                   np.zeros(len(labels), dtype=np.float32))
+
+    @classmethod
+    def load(cls, path, min_confidence=0.5):
+        with np.load(path, allow_pickle=False) as data:
+            return cls([str(label) for label in data["labels"]], data["weights"], data["bias"],
+                       min_confidence)
+
+    def save(self, path):
+        with open(path, "wb") as fh:
+            np.savez_compressed(fh, labels=np.array(self.labels), weights=self.weights, bias=self.bias)
+
+    def _probabilities(self, logits):
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    def predict_proba(self, text):
+        return self._feature_proba(hashed_features(text, self.n_features))
+
+    def _feature_proba(self, features):
+        return self._probabilities(self.bias + self.weights[features].sum(axis=0))
+
+    def predict(self, text):
+        """
+        (label, confidence) for lowercased text.
+        """
+        return self.predict_features(hashed_features(text, self.n_features))
+
+    def predict_features(self, features):
+        """
+        predict() for feature indices already computed, e.g. by a
+        HashedFeatureStream.
+        """
+        probs = self._feature_proba(features)
+        best = int(probs.argmax())
+        return self.labels[best], float(probs[best])
+
+    def predict_batch(self, texts):
+        rows = [hashed_features(text, self.n_features) for text in texts]
+        lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+        indices = np.fromiter((i for row in rows for i in row), dtype=np.int64, count=int(lengths.sum()))
+        logits = np.tile(self.bias.astype(np.float64), (len(rows), 1))
+        np.add.at(logits, np.repeat(np.arange(len(rows)), lengths), self.weights[indices])
+        probs = self._probabilities(logits)
+        best = probs.argmax(axis=1)
+        return [(self.labels[b], float(p)) for b, p in zip(best.tolist(), probs[np.arange(len(rows)), best])]
+
+    def fallback(self, predictions, default_intent):
+        """
+        (intent, category) for predictions, keeping the default intent when
+        the model is not confident enough.
+        """
+        label, confidence = predictions
+        if confidence < self.min_confidence or label == default_intent:
+            return default_intent, default_intent
+        return label, FALLBACK_CATEGORY
+
+    def train_step(self, features, label_index, learning_rate):
+        probs = self._probabilities(self.bias + self.weights[features].sum(axis=0))
+        probs[label_index] -= 1.0
+        gradient = (learning_rate * probs).astype(np.float32)
+        self.weights[features] -= gradient
+        self.bias -= gradient
+
+
+def train_model(rows, labels, n_features=2 ** 18, epochs=5, learning_rate=0.2, progress=None):
+    """
+    Train a HashedLinearModel with SGD. `rows` is called once to collect
+    the labels and once per epoch, and returns an iterable of (normalized
+    text, label); `labels` fixes the order of the known labels, any others
+    found in the rows are appended.
+    """
+    if np is None:
+        raise RuntimeError("training the fallback model requires NumPy")
+    labels = list(labels)
+    for _, label in rows():
+        if label not in labels:
+            labels.append(label)
+    label_index = {label: i for i, label in enumerate(labels)}
+
+    model = HashedLinearModel.zeros(labels, n_features)
+    seen = 0
+    for epoch in range(epochs):
+        rate = learning_rate / (1 + epoch)
+        for normalized, label in rows():
+            model.train_step(hashed_features(normalized, n_features), label_index[label], rate)
+            seen += 1
+        if progress is not None:
+            progress(epoch + 1, seen)
+    return HashedLinearModel(model.labels, model.weights, model.bias)
+
+
+def load_fallback_model():
+    path = os.environ.get("EMAIL_INTENT_MODEL")
+    if not path:
+        return None
+    if np is None:
+        logger.warning("EMAIL_INTENT_MODEL is set but NumPy is not installed; fallback model disabled")
+        return None
+    min_confidence = float(os.environ.get("EMAIL_INTENT_MODEL_MIN_CONFIDENCE", "0.5"))
+    return HashedLinearModel.load(path, min_confidence)
@@ -0,0 +1,213 @@
+"""
+Prediction log for the email intent classifier.
+
+Live predictions are appended to a local SQLite file (EMAIL_INTENT_LOG_DB)
+by a background writer, together with hourly per-intent rollups that the
+dashboard reads for its traffic chart.
+"""
+
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Open logs, for the process-wide fork and exit hooks at the end of the
+# module; held weakly so a log that is dropped is not kept alive by them.
+_open_logs = weakref.WeakSet()
+
+
+class PredictionLog:
+    """
+    Append-only SQLite log of predictions plus an hourly rollup table.
+    append() only queues the row in memory; a background thread writes the
+    queued rows in bulk and upserts the rollups in the same transaction, so
+    dashboard queries read a few rows per hour instead of every prediction.
+    When `max_buffer` rows are waiting, further rows are dropped (and
+    counted) rather than blocking requests.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS predictions (
+            id INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            intent TEXT NOT NULL,
+            keyword_ids TEXT NOT NULL,
+            text_hash TEXT,
+            latency REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS predictions_ts ON predictions (ts);
+        CREATE INDEX IF NOT EXISTS predictions_intent_ts ON predictions (intent, ts);
+        CREATE TABLE IF NOT EXISTS predictions_hourly (
+            hour INTEGER NOT NULL,
+            intent TEXT NOT NULL,
+            predictions INTEGER NOT NULL,
+            latency_sum REAL NOT NULL,
+            latency_max REAL NOT NULL,
+            PRIMARY KEY (hour, intent)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path, flush_interval=1.0, batch_size=1000, max_buffer=100000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.written = 0
+        self.dropped = 0
+        self._buffer = deque()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._local = threading.local()
+        self._connection().executescript(self.SCHEMA)
+        self._start_writer()
+        _open_logs.add(self)
+
+    def _start_writer(self):
+        self._writer = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+        self._writer.start()
+
+    def _after_fork(self):
+        # Threads don't survive fork(): every prefork worker starts its own
+        # writer, and rows still buffered by the parent stay the parent's.
+        self._buffer = deque()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if not self._closed:
+            self._start_writer()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def append(self, intent, keyword_ids, text_hash, latency, ts=None):
+        if len(self._buffer) >= self.max_buffer:
+            with self._lock:
+                self.dropped += 1
+            return
+        self._buffer.append((time.time() if ts is None else ts, intent,
+                             ",".join(map(str, keyword_ids)), text_hash, latency))
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    def _run(self):
+        conn = self._connect()
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._flush(conn)
+        self._flush(conn)
+        conn.close()
+
+    def _flush(self, conn):
+        while self._buffer:
+            rows = []
+            while self._buffer and len(rows) < self.batch_size:
+                rows.append(self._buffer.popleft())
+
+            rollup = {}
+            for ts, intent, _, _, latency in rows:
+                entry = rollup.setdefault((int(ts // 3600) * 3600, intent), [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += latency
+                entry[2] = max(entry[2], latency)
+
+            try:
+                conn.execute("BEGIN")
+                conn.executemany("INSERT INTO predictions (ts, intent, keyword_ids, text_hash, latency)"
+                                 " VALUES (?, ?, ?, ?, ?)", rows)
+                conn.executemany(
+                    "INSERT INTO predictions_hourly (hour, intent, predictions, latency_sum, latency_max)"
+                    " VALUES (?, ?, ?, ?, ?) ON CONFLICT (hour, intent) DO UPDATE SET"
+                    " predictions = predictions + excluded.predictions,"
+                    " latency_sum = latency_sum + excluded.latency_sum,"
+                    " latency_max = MAX(latency_max, excluded.latency_max)",
+                    [(hour, intent, *entry) for (hour, intent), entry in rollup.items()])
+                conn.execute("COMMIT")
+                with self._lock:
+                    self.written += len(rows)
+            except sqlite3.Error:
+                # BEGIN itself may have failed; an unguarded ROLLBACK would
+                # then raise and kill the writer thread.
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                with self._lock:
+                    self.dropped += len(rows)
+                logger.exception("Could not write %d predictions to %s", len(rows), self.path)
+
+    def traffic(self, hours=48, now=None):
+        """
+        Per-intent prediction counts for each of the last `hours` hours,
+        read from the rollup table only.
+        """
+        now = time.time() if now is None else now
+        last = int(now // 3600) * 3600
+        first = last - (hours - 1) * 3600
+        rows = self._connection().execute(
+            "SELECT hour, intent, predictions, latency_sum, latency_max FROM predictions_hourly"
+            " WHERE hour >= ? ORDER BY hour", (first,)).fetchall()
+
+        slots = {first + i * 3600: i for i in range(hours)}
+        series = {}
+        totals = {}
+        for hour, intent, count, latency_sum, latency_max in rows:
+            if hour not in slots:
+                continue
+            series.setdefault(intent, [0] * hours)[slots[hour]] = count
+            total = totals.setdefault(intent, [0, 0.0, 0.0])
+            total[0] += count
+            total[1] += latency_sum
+            total[2] = max(total[2], latency_max)
+
+        return {
+            "hours": [time.strftime("%m-%d %H:00", time.localtime(hour)) for hour in slots],
+            "series": [{"intent": intent, "counts": series[intent]} for intent in sorted(series)],
+            "totals": [
+                {
+                    "intent": intent,
+                    "predictions": count,
+                    "avg_latency_ms": round(latency_sum / count * 1000, 3),
+                    "max_latency_ms": round(latency_max * 1000, 3),
+                }
+                for intent, (count, latency_sum, latency_max) in sorted(totals.items())
+            ],
+            "total": sum(total[0] for total in totals.values()),
+            "pending": len(self._buffer),
+            "dropped": self.dropped,
+        }
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._wake.set()
+            self._writer.join()
+        _open_logs.discard(self)
+
+
+def _after_fork_in_child():
+    for log in list(_open_logs):
+        log._after_fork()
+
+
+def _close_open_logs():
+    for log in list(_open_logs):
+        log.close()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+atexit.register(_close_open_logs)
@@ -0,0 +1,487 @@
+"""
+Queue-consumer worker mode for the email intent classifier.
+
+Emails are pulled from a queue backend in micro-batches, classified with
+the active rules and written to a result sink; a batch is acknowledged
+only once its results are stored. When the sink falls behind, the worker
+stops pulling new work until it catches up.
+
+The default stand-in backend is a local SQLite database that holds both
+the queue and the results:
+
+    python queue_worker.py enqueue queue.db mails.jsonl
+    python queue_worker.py work queue.db --batch-size 64 --drain
+    python queue_worker.py results queue.db > results.jsonl
+"""
+
+import abc
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import app_full
+
+
+class QueueBackend(abc.ABC):
+    """
+    Interface for queue backends. Messages are (message_id, payload) pairs;
+    leased messages become visible again if not acknowledged in time.
+    """
+
+    @abc.abstractmethod
+    def enqueue(self, payloads):
+        """Add payloads to the queue; returns how many were added."""
+
+    @abc.abstractmethod
+    def lease(self, max_messages, lease_seconds):
+        """Claim up to `max_messages` messages for `lease_seconds`."""
+
+    @abc.abstractmethod
+    def ack(self, message_ids):
+        """Mark leased messages as done."""
+
+    @abc.abstractmethod
+    def release(self, message_ids):
+        """Return leased messages to the queue for another attempt."""
+
+    @abc.abstractmethod
+    def pending(self):
+        """Number of messages not yet done."""
+
+
+class ResultSink(abc.ABC):
+    """
+    Interface for result sinks. submit() hands over one batch of results
+    together with a callback to run once they are durably stored; lag() is
+    the number of batches accepted but not yet stored. Once storing fails,
+    check() and submit() raise instead of accepting more work.
+    """
+
+    @abc.abstractmethod
+    def submit(self, results, on_stored):
+        """Queue one batch of (message_id, result) pairs for storing."""
+
+    @abc.abstractmethod
+    def lag(self):
+        """Batches accepted but not yet stored."""
+
+    def check(self):
+        """Raise if the sink can no longer store results."""
+
+    def close(self):
+        pass
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SQLiteQueue(QueueBackend):
+    """
+    Work queue in a local SQLite file. Leasing runs in an IMMEDIATE
+    transaction, so several worker processes can share one database.
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS emails (
+                id INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'ready',
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                enqueued_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS emails_state ON emails (state, id);
+            CREATE TABLE IF NOT EXISTS results (
+                email_id INTEGER PRIMARY KEY,
+                result TEXT NOT NULL,
+                stored_at REAL NOT NULL
+            );
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    def enqueue(self, payloads):
+        conn = self._conn()
+        now = time.time()
+        count = 0
+        conn.execute("BEGIN")
+        try:
+            for payload in payloads:
+                conn.execute("INSERT INTO emails (payload, enqueued_at) VALUES (?, ?)", (payload, now))
+                count += 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return count
+
+    def lease(self, max_messages, lease_seconds):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # A lease that expired was never acked or released, typically
+            # because the message crashed its worker: park it once it has
+            # used up its attempts instead of retrying it forever.
+            conn.execute("UPDATE emails SET state = 'failed', lease_until = NULL"
+                         " WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                         (now, self.max_attempts))
+            rows = conn.execute(
+                "SELECT id, payload FROM emails"
+                " WHERE state = 'ready' OR (state = 'leased' AND lease_until < ? AND attempts < ?)"
+                " ORDER BY id LIMIT ?", (now, self.max_attempts, max_messages)).fetchall()
+            conn.executemany(
+                "UPDATE emails SET state = 'leased', lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                [(now + lease_seconds, row[0]) for row in rows])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def ack(self, message_ids):
+        self._conn().executemany("UPDATE emails SET state = 'done', lease_until = NULL WHERE id = ?",
+                                 [(mid,) for mid in message_ids])
+
+    def release(self, message_ids):
+        # Messages that keep failing are parked instead of retried forever.
+        self._conn().executemany(
+            "UPDATE emails SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'ready' END,"
+            " lease_until = NULL WHERE id = ?",
+            [(self.max_attempts, mid) for mid in message_ids])
+
+    def pending(self):
+        row = self._conn().execute("SELECT COUNT(*) FROM emails WHERE state IN ('ready', 'leased')").fetchone()
+        return row[0]
+
+    def stats(self):
+        rows = self._conn().execute("SELECT state, COUNT(*) FROM emails GROUP BY state").fetchall()
+        return dict(rows)
+
+    def iter_results(self):
+        cursor = self._conn().execute("SELECT email_id, result FROM results ORDER BY email_id")
+        for email_id, result in cursor:
+            yield email_id, json.loads(result)
+
+
+class SQLiteResultSink(ResultSink):
+    """
+    Stores results in the queue database from a background writer thread.
+    Results and the acknowledgement of their messages are committed in the
+    same transaction, so a message is never marked done without its result.
+    At most `max_batches` batches wait in memory; submit() blocks beyond that.
+    A write that hits a transient sqlite3.OperationalError (e.g. "database
+    is locked") is retried up to `retries` times with exponential backoff;
+    only then is the batch released and the sink marked as failed.
+    """
+
+    def __init__(self, sqlite_queue, max_batches=8, retries=3, retry_delay=0.05):
+        self.queue = sqlite_queue
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._pending = queue.Queue(maxsize=max_batches)
+        self._error = None
+        self._writer = threading.Thread(target=self._run, name="result-writer", daemon=True)
+        self._writer.start()
+
+    def submit(self, results, on_stored=None):
+        self.check()
+        self._pending.put((results, on_stored))
+
+    def lag(self):
+        return self._pending.qsize()
+
+    def check(self):
+        if self._error is not None:
+            raise RuntimeError("result writer failed") from self._error
+
+    def _run(self):
+        conn = _connect(self.queue.path)
+        while True:
+            item = self._pending.get()
+            if item is None:
+                self._pending.task_done()
+                break
+            results, on_stored = item
+            stored = False
+            try:
+                self._store(conn, results)
+                stored = True
+                if on_stored is not None:
+                    on_stored()
+            except Exception as exc:
+                # Recorded first, so a failing rollback or release cannot
+                # kill the writer unnoticed and leave the worker waiting.
+                self._error = exc
+                try:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    if not stored:
+                        self.queue.release([mid for mid, _ in results])
+                except Exception:
+                    pass
+            finally:
+                self._pending.task_done()
+        conn.close()
+
+    def _store(self, conn, results):
+        for attempt in range(self.retries + 1):
+            try:
+                now = time.time()
+                conn.execute("BEGIN")
+                conn.executemany("INSERT OR REPLACE INTO results (email_id, result, stored_at) VALUES (?, ?, ?)",
+                                 [(mid, json.dumps(result), now) for mid, result in results])
+                conn.executemany("UPDATE emails SET state = 'done', lease_until = NULL WHERE id = ?",
+                                 [(mid,) for mid, _ in results])
+                conn.execute("COMMIT")
+                return
+            except sqlite3.OperationalError:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+    def close(self):
+        self._pending.put(None)
+        self._writer.join()
+
+
+class JSONLResultSink(ResultSink):
+    """
+    Appends results to a JSONL file; batches are flushed and fsynced before
+    `on_stored` acknowledges them. Use with any backend whose ack() is
+    separate from storing results. A batch that cannot be written is
+    released back to the queue.
+    """
+
+    def __init__(self, path, queue_backend, max_batches=8):
+        self.path = path
+        self.queue = queue_backend
+        self._pending = queue.Queue(maxsize=max_batches)
+        self._error = None
+        self._writer = threading.Thread(target=self._run, name="jsonl-writer", daemon=True)
+        self._writer.start()
+
+    def submit(self, results, on_stored=None):
+        self.check()
+        self._pending.put((results, on_stored))
+
+    def lag(self):
+        return self._pending.qsize()
+
+    def check(self):
+        if self._error is not None:
+            raise RuntimeError("result writer failed") from self._error
+
+    def _run(self):
+        try:
+            fh = open(self.path, "a", encoding="utf-8")
+        except OSError as exc:
+            self._error = exc
+            fh = None
+        # Keep consuming after a failure so queued batches are released and
+        # close() does not wait forever.
+        while True:
+            item = self._pending.get()
+            if item is None:
+                self._pending.task_done()
+                break
+            results, on_stored = item
+            try:
+                if fh is None:
+                    raise self._error
+                for mid, result in results:
+                    fh.write(json.dumps({"message_id": mid, **result}, ensure_ascii=False) + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+                self.queue.ack([mid for mid, _ in results])
+                if on_stored is not None:
+                    on_stored()
+            except Exception as exc:
+                self._error = exc
+                self.queue.release([mid for mid, _ in results])
+            finally:
+                self._pending.task_done()
+        if fh is not None:
+            fh.close()
+
+    def close(self):
+        self._pending.put(None)
+        self._writer.join()
+
+
+def classify_payload(payload, rules):
+    """
+    Result dict for one queued payload: a JSON object with "text" (and
+    optionally "format") or a plain string. Like the classify command, a
+    payload starting with "{" must be such an object; anything else raises
+    ValueError, so the message is retried and finally parked as failed.
+    """
+    fmt = "auto"
+    text = payload
+    if payload.lstrip().startswith("{"):
+        try:
+            record = json.loads(payload)
+        except ValueError as exc:
+            raise ValueError(f"invalid JSON: {exc}") from None
+        if not isinstance(record, dict) or not isinstance(record.get("text"), str):
+            raise ValueError("missing 'text' string")
+        text, fmt = record["text"], record.get("format", "auto")
+        if fmt not in ("auto", "text", "rfc822"):
+            raise ValueError("'format' must be one of auto, text, rfc822")
+    answer = app_full.match_email(app_full.prepare_text(text, fmt), rules)
+    return app_full.match_result(rules, *answer, rules_version=rules.version)
+
+
+class ClassificationWorker:
+    """
+    Pull micro-batches from `queue_backend`, classify them and hand the
+    results to `sink`. Intake pauses while the sink has `max_lag` or more
+    batches outstanding.
+    """
+
+    def __init__(self, queue_backend, sink, batch_size=64, lease_seconds=60.0,
+                 idle_sleep=0.5, max_lag=4):
+        self.queue = queue_backend
+        self.sink = sink
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.idle_sleep = idle_sleep
+        self.max_lag = max_lag
+        self.processed = 0
+        self.failed = 0
+        self.throttled = 0
+
+    def run_once(self):
+        """
+        Process one batch; returns the number of messages leased.
+        """
+        self.sink.check()
+        while self.sink.lag() >= self.max_lag:
+            # Backpressure: don't lease more work while results are piling up.
+            self.throttled += 1
+            time.sleep(0.01)
+            self.sink.check()
+
+        batch = self.queue.lease(self.batch_size, self.lease_seconds)
+        if not batch:
+            return 0
+
+        rules = app_full.get_rules()
+        results = []
+        failed = []
+        for message_id, payload in batch:
+            try:
+                results.append((message_id, classify_payload(payload, rules)))
+            except Exception:
+                app_full.app.logger.exception("Could not classify queued email %s", message_id)
+                failed.append(message_id)
+
+        if failed:
+            self.queue.release(failed)
+            self.failed += len(failed)
+        if results:
+            try:
+                self.sink.submit(results)
+            except RuntimeError:
+                self.queue.release([mid for mid, _ in results])
+                raise
+            self.processed += len(results)
+        return len(batch)
+
+    def run(self, stop_event=None, drain=False):
+        """
+        Work until `stop_event` is set, or until the queue is empty when
+        `drain` is true.
+        """
+        while stop_event is None or not stop_event.is_set():
+            if self.run_once():
+                continue
+            if drain and not self.queue.pending():
+                break
+            time.sleep(self.idle_sleep)
+
+
+def _read_payloads(path):
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8", errors="replace")
+    try:
+        for line in stream:
+            line = line.rstrip("\r\n")
+            if line.strip():
+                yield line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Queue-consumer worker for the email intent classifier")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="add emails (JSONL objects or plain lines) to the queue")
+    enqueue.add_argument("db", help="SQLite queue file")
+    enqueue.add_argument("input", nargs="?", default="-")
+
+    work = commands.add_parser("work", help="consume the queue")
+    work.add_argument("db", help="SQLite queue file")
+    work.add_argument("--batch-size", type=int, default=64)
+    work.add_argument("--lease-seconds", type=float, default=60.0)
+    work.add_argument("--max-lag", type=int, default=4, help="sink batches outstanding before intake pauses")
+    work.add_argument("--results-jsonl", default=None, help="write results to this JSONL file instead of the db")
+    work.add_argument("--drain", action="store_true", help="exit once the queue is empty")
+
+    results = commands.add_parser("results", help="print stored results as JSONL")
+    results.add_argument("db", help="SQLite queue file")
+
+    stats = commands.add_parser("stats", help="print message counts per state")
+    stats.add_argument("db", help="SQLite queue file")
+
+    args = parser.parse_args(argv)
+    backend = SQLiteQueue(args.db)
+
+    if args.command == "enqueue":
+        print(json.dumps({"enqueued": backend.enqueue(_read_payloads(args.input))}))
+    elif args.command == "results":
+        for email_id, result in backend.iter_results():
+            print(json.dumps({"message_id": email_id, **result}, ensure_ascii=False))
+    elif args.command == "stats":
+        print(json.dumps(backend.stats()))
+    else:
+        if args.results_jsonl:
+            sink = JSONLResultSink(args.results_jsonl, backend, max_batches=args.max_lag * 2)
+        else:
+            sink = SQLiteResultSink(backend, max_batches=args.max_lag * 2)
+        worker = ClassificationWorker(backend, sink, args.batch_size, args.lease_seconds, max_lag=args.max_lag)
+        stop = threading.Event()
+        try:
+            worker.run(stop, drain=args.drain)
+        except KeyboardInterrupt:
+            stop.set()
+        finally:
+            sink.close()
+        print(json.dumps({"processed": worker.processed, "failed": worker.failed,
+                          "throttled": worker.throttled, **backend.stats()}), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Rule profiling for the email intent classifier.
+
+A RuleProfiler is fed normalized emails and reports, per keyword, how
+often it matched and how often it decided the intent, plus how long each
+intent's keyword list takes to scan on its own. Keywords that never hit,
+never decide or are covered by a shorter keyword are candidates for
+pruning:
+
+    python app_full.py classify mails.jsonl --profile profile.json > results.jsonl
+
+In the web app, EMAIL_INTENT_PROFILE_SAMPLE profiles a share of the
+requests; the report is served at GET /api/profile.
+"""
+
+import threading
+import time
+from collections import Counter
+
+
+class RuleProfiler:
+    """
+    Collects per-keyword hit counts, per-intent decision (short-circuit)
+    rates and the time each intent's keyword list would cost to scan on its
+    own, and reports dead, shadowed and subsumed keywords for rule pruning.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.emails = 0
+        self.scan_seconds = 0.0
+        self.keyword_hits = [0] * len(rules.keywords)
+        self.decisive_hits = [0] * len(rules.keywords)
+        self.sole_hits = [0] * len(rules.keywords)
+        self.decided = Counter()
+        self.list_seconds = [0.0] * len(rules.intents)
+        self._list_matchers = rules.list_matchers()
+        self._lock = threading.Lock()
+
+    def record(self, normalized):
+        rules = self.rules
+        start = time.perf_counter()
+        hits = rules.hits(normalized)
+        scanned = time.perf_counter() - start
+
+        list_seconds = []
+        for matcher in self._list_matchers:
+            start = time.perf_counter()
+            matcher.scan(normalized)
+            list_seconds.append(time.perf_counter() - start)
+
+        intent, _category, ids = rules.resolve(hits)
+        with self._lock:
+            self.emails += 1
+            self.scan_seconds += scanned
+            for rank, seconds in enumerate(list_seconds):
+                self.list_seconds[rank] += seconds
+            self.decided[intent] += 1
+            for kid in hits:
+                self.keyword_hits[kid] += 1
+            for kid in ids:
+                self.decisive_hits[kid] += 1
+            if len(ids) == 1:
+                self.sole_hits[ids[0]] += 1
+
+    def subsumed(self):
+        """
+        Keywords that contain another keyword of the same or a higher-priority
+        intent: wherever they match, that shorter keyword matches too, so they
+        never change the predicted intent.
+        """
+        rules = self.rules
+        found = []
+        for kid, keyword in enumerate(rules.keywords):
+            for other, shorter in enumerate(rules.keywords):
+                if (other != kid and shorter in keyword and shorter != keyword
+                        and rules.keyword_ranks[other] <= rules.keyword_ranks[kid]):
+                    found.append({"keyword": keyword, "covered_by": shorter,
+                                  "same_intent": rules.keyword_ranks[other] == rules.keyword_ranks[kid]})
+                    break
+        return found
+
+    def report(self):
+        rules = self.rules
+        with self._lock:
+            keywords = [
+                {
+                    "keyword": keyword,
+                    "intent": rules.intents[rank],
+                    "hits": self.keyword_hits[kid],
+                    "decisive_hits": self.decisive_hits[kid],
+                    "sole_hits": self.sole_hits[kid],
+                }
+                for kid, (keyword, rank) in enumerate(zip(rules.keywords, rules.keyword_ranks))
+            ]
+            intents = [
+                {
+                    "intent": intent,
+                    "decided": self.decided[intent],
+                    "decision_rate": round(self.decided[intent] / self.emails, 4) if self.emails else None,
+                    "list_scan_seconds": round(self.list_seconds[rank], 6) if rank < len(self.list_seconds) else None,
+                }
+                for rank, intent in enumerate(rules.intents + (rules.default_intent,))
+            ]
+            emails, scan_seconds = self.emails, self.scan_seconds
+
+        return {
+            "rules_version": rules.version,
+            "emails": emails,
+            "scan_seconds": round(scan_seconds, 6),
+            "intents": intents,
+            "keywords": keywords,
+            "dead": [row["keyword"] for row in keywords if row["hits"] == 0],
+            "shadowed": [row["keyword"] for row in keywords if row["hits"] and not row["decisive_hits"]],
+            "never_sole": [row["keyword"] for row in keywords if row["decisive_hits"] and not row["sole_hits"]],
+            "subsumed": self.subsumed(),
+        }
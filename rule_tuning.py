@@ -0,0 +1,575 @@
+"""
+Offline rule tuning for the email intent classifier.
+
+The labelled corpus is scanned once to build a hit index: for every
+candidate phrase, a bitset (a Python int, bit i = email i) of the emails
+containing it. A rule set is then scored from the index alone, by
+combining bitsets in priority order and counting bits per true label, so
+re-scoring a changed keyword list never touches the raw text again:
+
+    python rule_tuning.py index labelled.jsonl --candidates pool.txt --out hits.json
+    python rule_tuning.py score hits.json --rules candidate.json
+
+The search command looks for better keyword lists: it mutates the rules
+(dropping phrases, adding phrases from the indexed candidate pool,
+swapping intent priorities), scores the variants on a process pool and
+reports the Pareto front of macro-F1 against phrase count. The search is
+cross-validated: it is repeated once per fold on the other folds only and
+each run's front is scored on the fold it never saw, which estimates how
+much of the gain carries over to unseen mail:
+
+    python rule_tuning.py search hits.json --generations 30 --population 200
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import app_full
+
+
+def _bitset(positions, n):
+    # Setting bits one by one on an int is quadratic; fill a buffer instead.
+    buffer = bytearray((n + 7) // 8)
+    for i in positions:
+        buffer[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buffer, "little")
+
+
+class HitIndex:
+    """
+    Phrase -> bitset of the emails (rows of the labelled corpus) that
+    contain it, plus a bitset per true label and, when a fallback model was
+    loaded at build time, a bitset per intent the model would assign.
+    """
+
+    def __init__(self, phrases, bitmaps, labels, fallback, rows, source=None):
+        self.phrases = list(phrases)
+        self.bitmaps = list(bitmaps)
+        self.labels = dict(labels)
+        self.fallback = dict(fallback)
+        self.rows = rows
+        self.source = source
+        self.all_rows = (1 << rows) - 1
+        self._phrase_index = {phrase: i for i, phrase in enumerate(self.phrases)}
+
+    @classmethod
+    def build(cls, source=None, phrases=None, rules=None, progress=None, progress_every=100000):
+        """
+        Index `phrases` (default: the keywords of `rules`, or of the active
+        rules) over the labelled corpus `source` (default: as the dashboard).
+        Texts go through the same scan window and normalization as
+        classify_email, and the same kind of matcher (make_matcher) finds
+        the phrases.
+        """
+        rules = rules or app_full.get_rules()
+        source = source or app_full.EVALUATION_SOURCE
+        if phrases is None:
+            phrases = rules.keywords
+        phrases = list(dict.fromkeys(app_full.normalize_phrase(p) for p in phrases if p.strip()))
+        matcher = app_full.make_matcher(phrases)
+        model = app_full.FALLBACK_MODEL
+
+        hits = [[] for _ in phrases]
+        label_rows = {}
+        model_rows = {}
+        rows = 0
+        for text, label in app_full.iter_labelled_dataset(source):
+            normalized = app_full.scan_window(text)
+            for pid in matcher.scan(normalized):
+                hits[pid].append(rows)
+            label_rows.setdefault(label, []).append(rows)
+            if model is not None:
+                intent, category = model.fallback(model.predict(normalized), None)
+                if category == app_full.FALLBACK_CATEGORY:
+                    model_rows.setdefault(intent, []).append(rows)
+            rows += 1
+            if progress is not None and rows % progress_every == 0:
+                progress(rows)
+
+        return cls(
+            phrases,
+            [_bitset(positions, rows) for positions in hits],
+            {label: _bitset(positions, rows) for label, positions in label_rows.items()},
+            {intent: _bitset(positions, rows) for intent, positions in model_rows.items()},
+            rows,
+            source,
+        )
+
+    def phrase_bits(self, phrase):
+        index = self._phrase_index.get(phrase)
+        if index is None:
+            index = self._phrase_index.get(app_full.normalize_phrase(phrase))
+        if index is None:
+            raise KeyError(f"phrase not in the index: {phrase!r}")
+        return self.bitmaps[index]
+
+    def confusion(self, rules, mask=None):
+        """
+        ConfusionMatrix of `rules` (a RuleSet) over the indexed rows, or over
+        the rows set in `mask`, with classify_email's first-match semantics:
+        the highest-priority intent with any phrase present wins, and rows
+        no rule matches go to the fallback model's intent or the default.
+        """
+        covered = [0] * len(rules.intents)
+        for kid, phrase in enumerate(rules.keywords):
+            covered[rules.keyword_ranks[kid]] |= self.phrase_bits(phrase)
+        return self._confusion(zip(rules.intents, covered), rules.default_intent, mask)
+
+    def variant_confusion(self, variant, default_intent, mask=None):
+        """
+        Like confusion(), for a variant: a sequence of (intent, phrases)
+        in priority order.
+        """
+        decisions = []
+        for intent, phrases in variant:
+            bits = 0
+            for phrase in phrases:
+                bits |= self.phrase_bits(phrase)
+            decisions.append((intent, bits))
+        return self._confusion(decisions, default_intent, mask)
+
+    def _confusion(self, decisions, default_intent, mask):
+        remaining = self.all_rows if mask is None else mask & self.all_rows
+        matrix = app_full.ConfusionMatrix(app_full.INTENTS)
+
+        def assign(rows, intent):
+            for label, label_bits in self.labels.items():
+                n = (rows & label_bits).bit_count()
+                if n:
+                    matrix.update(label, intent, n)
+
+        for intent, covered in decisions:
+            decided = covered & remaining
+            if decided:
+                assign(decided, intent)
+                remaining &= ~decided
+
+        for intent, model_bits in self.fallback.items():
+            decided = model_bits & remaining
+            if decided:
+                assign(decided, intent)
+                remaining &= ~decided
+        assign(remaining, default_intent)
+        return matrix
+
+    def evaluate(self, rules, mask=None):
+        """
+        evaluate_classifier()-shaped metrics of `rules`, from the index alone.
+        """
+        return app_full.metrics_report(self.confusion(rules, mask), self.source)
+
+    def save(self, path):
+        document = {
+            "format": 1,
+            "source": self.source,
+            "rows": self.rows,
+            "phrases": self.phrases,
+            "bitmaps": [format(bits, "x") for bits in self.bitmaps],
+            "labels": {label: format(bits, "x") for label, bits in self.labels.items()},
+            "fallback": {intent: format(bits, "x") for intent, bits in self.fallback.items()},
+        }
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(document, fh)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as fh:
+            document = json.load(fh)
+        if document.get("format") != 1:
+            raise ValueError(f"{path} is not a hit index file")
+        return cls(
+            document["phrases"],
+            [int(bits, 16) for bits in document["bitmaps"]],
+            {label: int(bits, 16) for label, bits in document["labels"].items()},
+            {intent: int(bits, 16) for intent, bits in document["fallback"].items()},
+            document["rows"],
+            document["source"],
+        )
+
+
+def read_phrases(path):
+    """
+    Candidate phrases, one per line ('#' starts a comment line).
+    """
+    with open(path, encoding="utf-8") as fh:
+        return [line.strip() for line in fh if line.strip() and not line.lstrip().startswith("#")]
+
+
+# --- Rule-variant search ---
+# A variant is a tuple of (intent, phrases) pairs in priority order, with
+# phrases a sorted tuple; the default intent is fixed by the base rules.
+
+def variant_from_rules(rules):
+    phrases = [[] for _ in rules.intents]
+    for kid, phrase in enumerate(rules.keywords):
+        phrases[rules.keyword_ranks[kid]].append(phrase)
+    return tuple((intent, tuple(sorted(p))) for intent, p in zip(rules.intents, phrases))
+
+
+def variant_phrase_count(variant):
+    return sum(len(phrases) for _, phrases in variant)
+
+
+def variant_document(variant, rules):
+    """
+    rules.json document for a variant; categories and keyword weights are
+    taken from the base `rules` where they apply.
+    """
+    categories = dict(zip(rules.intents, rules.categories))
+    weights = {}
+    for kid, phrase in enumerate(rules.keywords):
+        intent = rules.intents[rules.keyword_ranks[kid]]
+        per_label = {rules.labels[label]: weight for label, weight in rules.keyword_weights[kid]}
+        if per_label != {intent: 1.0}:
+            weights[(intent, phrase)] = per_label
+
+    intents = []
+    for priority, (intent, phrases) in enumerate(variant, start=1):
+        keywords = []
+        for phrase in phrases:
+            per_label = weights.get((intent, phrase))
+            if per_label is None:
+                keywords.append(phrase)
+            else:
+                own = per_label.pop(intent, 0.0)
+                keywords.append({"phrase": phrase, "weight": own, "weights": per_label})
+        rule = {"intent": intent, "priority": priority, "keywords": keywords}
+        if categories.get(intent, intent) != intent:
+            rule["category"] = categories[intent]
+        intents.append(rule)
+    return {"schema": 1, "default_intent": rules.default_intent,
+            "default_score": rules.default_score, "intents": intents}
+
+
+def describe_changes(base, variant):
+    base_phrases = dict(base)
+    changes = []
+    if [intent for intent, _ in base] != [intent for intent, _ in variant]:
+        changes.append("priority: " + " > ".join(intent for intent, _ in variant))
+    for intent, phrases in variant:
+        before = set(base_phrases.get(intent, ()))
+        changes += [f"+{intent}: {p}" for p in sorted(set(phrases) - before)]
+        changes += [f"-{intent}: {p}" for p in sorted(before - set(phrases))]
+    return changes
+
+
+def mutate(variant, pool, rng, max_changes=3):
+    """
+    A random neighbour of `variant`: 1..max_changes of dropping a phrase
+    (an intent keeps at least one), adding an unused pool phrase to an
+    intent, or swapping two adjacent intents' priorities.
+    """
+    rules = [list(phrases) for _, phrases in variant]
+    intents = [intent for intent, _ in variant]
+    for _ in range(rng.randint(1, max_changes)):
+        used = {phrase for phrases in rules for phrase in phrases}
+        unused = [phrase for phrase in pool if phrase not in used]
+        droppable = [i for i, phrases in enumerate(rules) if len(phrases) > 1]
+        moves = (["drop"] * bool(droppable) + ["add"] * bool(unused)
+                 + ["swap"] * (len(intents) > 1))
+        if not moves:
+            break
+        move = rng.choice(moves)
+        if move == "drop":
+            phrases = rules[rng.choice(droppable)]
+            phrases.remove(rng.choice(phrases))
+        elif move == "add":
+            rules[rng.randrange(len(rules))].append(rng.choice(unused))
+        else:
+            i = rng.randrange(len(intents) - 1)
+            intents[i], intents[i + 1] = intents[i + 1], intents[i]
+            rules[i], rules[i + 1] = rules[i + 1], rules[i]
+    return tuple((intent, tuple(sorted(phrases))) for intent, phrases in zip(intents, rules))
+
+
+def kfold_masks(rows, folds, seed=0):
+    """
+    `folds` disjoint row bitsets of (nearly) equal size, rows shuffled.
+    """
+    order = list(range(rows))
+    random.Random(seed).shuffle(order)
+    return [_bitset(order[k::folds], rows) for k in range(folds)]
+
+
+def pareto_front(scores):
+    """
+    Variants not dominated on (higher macro-F1, fewer phrases), sorted by
+    phrase count. `scores` maps variant -> macro-F1.
+    """
+    ranked = sorted(scores, key=lambda v: (variant_phrase_count(v), -scores[v]))
+    front = []
+    best = -1.0
+    for variant in ranked:
+        f1 = scores[variant]
+        if f1 > best:
+            front.append(variant)
+            best = f1
+    return front
+
+
+def _macro_f1(matrix):
+    # An empty row set has no averages; it scores 0 rather than failing.
+    return matrix.averages().get("macro", {}).get("f1", 0.0)
+
+
+def _mean(values):
+    return sum(values) / len(values)
+
+
+def _std(values):
+    mean = _mean(values)
+    return (sum((v - mean) ** 2 for v in values) / len(values)) ** 0.5
+
+
+_search_state = None
+
+
+def _init_search_worker(index, fold_masks, default_intent):
+    global _search_state
+    _search_state = (index, fold_masks, default_intent, {})
+
+
+def _training_mask(held_out):
+    """
+    Rows of every fold but `held_out` (None: all rows), built once per
+    worker process.
+    """
+    _index, fold_masks, _default_intent, masks = _search_state
+    if held_out is None:
+        return None
+    mask = masks.get(held_out)
+    if mask is None:
+        mask = 0
+        for k, fold in enumerate(fold_masks):
+            if k != held_out:
+                mask |= fold
+        masks[held_out] = mask
+    return mask
+
+
+def _score_variant(task):
+    """
+    Macro-F1 of a variant on the training rows of one search run, as the
+    dashboard computes it. `task` is (variant, held-out fold or None).
+    """
+    variant, held_out = task
+    index, _fold_masks, default_intent, _masks = _search_state
+    mask = _training_mask(held_out)
+    return _macro_f1(index.variant_confusion(variant, default_intent, mask))
+
+
+def _evolve(executor, workers, base, pool, rng, generations, population, held_out, progress):
+    """
+    One search run: (scores, front) over the rows outside fold `held_out`.
+    """
+    scores = {}
+    front = [base]
+    candidates = [base]
+    for generation in range(generations + 1):
+        fresh = [variant for variant in dict.fromkeys(candidates) if variant not in scores]
+        chunksize = max(1, len(fresh) // (workers * 4))
+        tasks = [(variant, held_out) for variant in fresh]
+        for variant, f1 in zip(fresh, executor.map(_score_variant, tasks, chunksize=chunksize)):
+            scores[variant] = f1
+        front = pareto_front(scores)
+        if progress is not None:
+            progress(held_out, generation, len(scores), front, scores)
+        candidates = [mutate(rng.choice(front), pool, rng) for _ in range(population)]
+    return scores, front
+
+
+def search_variants(index, rules=None, generations=20, population=100, folds=5, workers=None,
+                    seed=0, progress=None):
+    """
+    Evolve variants of `rules`. Each generation mutates members of the
+    current Pareto front; variants are scored on a process pool. Phrases
+    already in the rules plus every other indexed phrase form the
+    candidate pool.
+
+    The search runs once per fold on the remaining folds, and that run's
+    front is scored on the held-out fold; a final run on all rows gives
+    the front to use. Returns (scores, front, cv): in-sample macro-F1 of
+    every variant the final run evaluated, its front, and per fold a list
+    of (phrase count, training macro-F1, held-out macro-F1) for the fold
+    run's front.
+    """
+    if not 2 <= folds <= index.rows:
+        raise ValueError(f"folds must be between 2 and the number of indexed emails ({index.rows}), got {folds}")
+    rules = rules or app_full.get_rules()
+    base = variant_from_rules(rules)
+    for _, phrases in base:
+        for phrase in phrases:
+            index.phrase_bits(phrase)   # fail early on phrases missing from the index
+    pool = list(index.phrases)
+    masks = kfold_masks(index.rows, folds, seed)
+    workers = workers or os.cpu_count() or 1
+
+    cv = []
+    with ProcessPoolExecutor(workers, initializer=_init_search_worker,
+                             initargs=(index, masks, rules.default_intent)) as executor:
+        for held_out in range(folds):
+            rng = random.Random(seed + held_out + 1)
+            fold_scores, fold_front = _evolve(executor, workers, base, pool, rng, generations, population,
+                                              held_out, progress)
+            cv.append([
+                (variant_phrase_count(variant), fold_scores[variant],
+                 _macro_f1(index.variant_confusion(variant, rules.default_intent, masks[held_out])))
+                for variant in fold_front
+            ])
+        scores, front = _evolve(executor, workers, base, pool, random.Random(seed), generations, population,
+                                None, progress)
+    return scores, front, cv
+
+
+def held_out_scores(cv, phrases):
+    """
+    Per fold, the held-out macro-F1 of the variant that fold's search would
+    pick with a budget of `phrases` phrases: its best on the training rows
+    among front members no larger than that. Folds with nothing that small
+    are skipped.
+    """
+    picked = []
+    for fold_front in cv:
+        within = [(train, held) for count, train, held in fold_front if count <= phrases]
+        if within:
+            picked.append(max(within)[1])
+    return picked
+
+
+def search_report(index, rules, scores, front, cv):
+    base = variant_from_rules(rules)
+
+    def entry(variant):
+        document = variant_document(variant, rules)
+        metrics = index.evaluate(app_full.parse_rules(document))
+        held_out = held_out_scores(cv, variant_phrase_count(variant))
+        return {
+            "phrases": variant_phrase_count(variant),
+            "macro_f1": round(scores[variant], 4),
+            "macro_f1_cv": round(_mean(held_out), 4) if held_out else None,
+            "macro_f1_cv_std": round(_std(held_out), 4) if held_out else None,
+            "accuracy": metrics["accuracy"],
+            "averages": metrics.get("averages"),
+            "changes": describe_changes(base, variant),
+            "rules": document,
+        }
+
+    folds = [
+        [{"phrases": count, "macro_f1_train": round(train, 4), "macro_f1_held_out": round(held, 4)}
+         for count, train, held in fold_front]
+        for fold_front in cv
+    ]
+    return {"source": index.source, "rows": index.rows, "evaluated": len(scores),
+            "base": entry(base), "front": [entry(variant) for variant in front], "folds": folds}
+
+
+def run_index_command(args):
+    def report(rows):
+        print(f"indexed {rows} emails...", file=sys.stderr, flush=True)
+
+    rules = app_full.load_rules(args.rules) if args.rules else app_full.get_rules()
+    phrases = list(rules.keywords)
+    for path in args.candidates:
+        phrases += read_phrases(path)
+
+    start = time.perf_counter()
+    index = HitIndex.build(args.dataset, phrases, rules, progress=report)
+    index.save(args.out)
+    print(json.dumps({"rows": index.rows, "phrases": len(index.phrases), "out": args.out,
+                      "seconds": round(time.perf_counter() - start, 3)}), file=sys.stderr)
+    return 0
+
+
+def run_score_command(args):
+    index = HitIndex.load(args.index)
+    try:
+        rules = app_full.load_rules(args.rules) if args.rules else app_full.get_rules()
+        start = time.perf_counter()
+        metrics = index.evaluate(rules)
+    except KeyError as exc:
+        # KeyError's str() adds quotes; args[0] is phrase_bits' message.
+        print(f"error: {exc.args[0]}; rebuild the index with it as a --candidates phrase", file=sys.stderr)
+        return 1
+    except ValueError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 1
+    metrics["rules_version"] = rules.version
+    metrics["scored_in_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    print(json.dumps(metrics, indent=2))
+    return 0
+
+
+def run_search_command(args):
+    def report(held_out, generation, evaluated, front, scores):
+        run = "final" if held_out is None else f"fold {held_out + 1}/{args.folds}"
+        best = max(scores[variant] for variant in front)
+        print(f"{run} generation {generation}: {evaluated} variants, front of {len(front)}, "
+              f"best training macro-F1 {best:.4f}", file=sys.stderr, flush=True)
+
+    index = HitIndex.load(args.index)
+    if not 2 <= args.folds <= index.rows:
+        print(f"error: --folds must be between 2 and the number of indexed emails ({index.rows})",
+              file=sys.stderr)
+        return 1
+    rules = app_full.load_rules(args.rules) if args.rules else app_full.get_rules()
+    start = time.perf_counter()
+    scores, front, cv = search_variants(index, rules, args.generations, args.population, args.folds,
+                                        args.workers, args.seed, progress=report)
+    result = search_report(index, rules, scores, front, cv)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+
+    if args.write_front:
+        os.makedirs(args.write_front, exist_ok=True)
+        for entry in result["front"]:
+            path = os.path.join(args.write_front, f"rules_{entry['phrases']:03d}_phrases.json")
+            with open(path, "w", encoding="utf-8") as fh:
+                json.dump(entry["rules"], fh, indent=2)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Offline rule tuning for the email intent classifier")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser("index", help="scan a labelled corpus once and save the phrase hit index")
+    index.add_argument("dataset", nargs="?", default=None,
+                       help=".csv / .jsonl file or .eml directory (default: the dashboard dataset)")
+    index.add_argument("--rules", default=None, help="rule file whose phrases to index (default: active rules)")
+    index.add_argument("--candidates", action="append", default=[], metavar="PHRASES.txt",
+                       help="extra candidate phrases, one per line (repeatable)")
+    index.add_argument("--out", default="hit_index.json")
+    index.set_defaults(handler=run_index_command)
+
+    score = commands.add_parser("score", help="score a rule file from a saved index")
+    score.add_argument("index", help="file written by the index command")
+    score.add_argument("--rules", default=None, help="rule file to score (default: active rules)")
+    score.set_defaults(handler=run_score_command)
+
+    search = commands.add_parser("search", help="search rule variants and report the macro-F1 / size Pareto front")
+    search.add_argument("index", help="file written by the index command (its phrases are the candidate pool)")
+    search.add_argument("--rules", default=None, help="rule file to start from (default: active rules)")
+    search.add_argument("--generations", type=int, default=20)
+    search.add_argument("--population", type=int, default=100, help="variants proposed per generation")
+    search.add_argument("--folds", type=int, default=5, help="cross-validation folds (the search runs once per fold, plus a final run)")
+    search.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    search.add_argument("--seed", type=int, default=0)
+    search.add_argument("--write-front", metavar="DIR", default=None,
+                        help="also write every front variant as a rule file into DIR")
+    search.set_defaults(handler=run_search_command)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Shadow evaluation for the email intent classifier.
+
+A candidate rule set can run next to the active one on a sample of live
+traffic before it is promoted. Requests only enqueue the text and the
+active answer; a background thread classifies it with the candidate and
+counts where the two disagree. The web app drives it through
+/admin/shadow.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from queue import Full, Queue
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowEvaluator:
+    """
+    Compares a candidate RuleSet with the active rules on sampled emails,
+    classifying them with `match(text, rules)` -> (intent, category, ids).
+    The queue is bounded and never blocks: when it is full the email is
+    dropped (and counted), so request latency does not depend on the
+    candidate. Disagreements are counted per (active, candidate) pair with
+    a few example texts each.
+    """
+
+    def __init__(self, candidate, match, sample_rate=0.1, queue_size=1000, max_examples=5, example_chars=300):
+        self.candidate = candidate
+        self._match = match
+        self.sample_rate = sample_rate
+        self.max_examples = max_examples
+        self.example_chars = example_chars
+        self.started = time.time()
+        self.compared = 0
+        self.agreed = 0
+        self.dropped = 0
+        self.disagreements = Counter()
+        self.examples = defaultdict(lambda: deque(maxlen=max_examples))
+        self._queue = Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="shadow-rules", daemon=True)
+        self._worker.start()
+
+    def submit(self, text, active_intent):
+        if random.random() >= self.sample_rate:
+            return
+        try:
+            self._queue.put_nowait((text, active_intent))
+        except Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            text, active = item
+            try:
+                intent = self.classify(text)
+            except Exception:
+                logger.exception("Shadow classification failed")
+                continue
+            with self._lock:
+                self.compared += 1
+                if intent == active:
+                    self.agreed += 1
+                else:
+                    self.disagreements[(active, intent)] += 1
+                    self.examples[(active, intent)].append(text[:self.example_chars])
+
+    def classify(self, text):
+        """
+        Intent the candidate gives `text`.
+        """
+        return self._match(text, self.candidate)[0]
+
+    def report(self):
+        with self._lock:
+            return {
+                "candidate_version": self.candidate.version,
+                "candidate_source": self.candidate.source,
+                "sample_rate": self.sample_rate,
+                "started": self.started,
+                "compared": self.compared,
+                "agreement": round(self.agreed / self.compared, 4) if self.compared else None,
+                "dropped": self.dropped,
+                "queued": self._queue.qsize(),
+                "disagreements": [
+                    {"active": active, "candidate": candidate, "count": count,
+                     "examples": list(self.examples[(active, candidate)])}
+                    for (active, candidate), count in self.disagreements.most_common()
+                ],
+            }
+
+    def stop(self):
+        # The sentinel may wait for a full queue; the worker keeps draining it.
+        self._queue.put(None)
+        self._worker.join()
@@ -0,0 +1,198 @@
+"""
+In-process instrumentation for the email intent classifier.
+
+Telemetry keeps counters and latency histograms and renders them in the
+Prometheus text format for GET /metrics; LiveCounters keeps the last few
+minutes of predictions in time buckets for the live dashboard stream.
+Both are safe to update from many request threads.
+"""
+
+import bisect
+import threading
+import time
+import weakref
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class _Shard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.histograms = {}
+
+
+class Telemetry:
+    """
+    Counters and latency histograms for the /metrics endpoint.
+    Every thread writes to its own shard, so recording never takes a lock;
+    a scrape sums the shards. Shards of finished threads are folded into a
+    single retired shard so short-lived request threads don't pile up.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard()
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+            weakref.finalize(threading.current_thread(), self._retire, shard)
+        return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            if shard in self._shards:
+                self._shards.remove(shard)
+                self._merge_into(self._retired, shard)
+
+    def _merge_into(self, target, shard):
+        for key, value in dict(shard.counters).items():
+            target.counters[key] += value
+        for key, hist in dict(shard.histograms).items():
+            merged = target.histograms.setdefault(key, [0] * (len(self.buckets) + 2) + [0.0])
+            for i, value in enumerate(list(hist)):
+                merged[i] += value
+
+    def inc(self, name, labels=(), value=1):
+        self._shard().counters[(name, labels)] += value
+
+    def observe(self, name, seconds, labels=()):
+        histograms = self._shard().histograms
+        hist = histograms.get((name, labels))
+        if hist is None:
+            # per-bucket counts, +Inf count, total count, sum of values
+            hist = histograms[(name, labels)] = [0] * (len(self.buckets) + 2) + [0.0]
+        hist[bisect.bisect_left(self.buckets, seconds)] += 1
+        hist[-2] += 1
+        hist[-1] += seconds
+
+    @contextmanager
+    def timer(self, name, labels=()):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, labels)
+
+    def snapshot(self):
+        total = _Shard()
+        with self._lock:
+            self._merge_into(total, self._retired)
+            for shard in self._shards:
+                self._merge_into(total, shard)
+        return total
+
+    def render(self, extra=()):
+        """
+        Prometheus text exposition of all counters and histograms, followed
+        by any (name, type, labels, value) samples passed in `extra`.
+        """
+        data = self.snapshot()
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(data.counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), hist in sorted(data.histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), hist):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist[-2]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist[-1]:.6f}")
+
+        for name, kind, labels, value in extra:
+            header(name, kind)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+               for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+class LiveCounters:
+    """
+    Ring buffer of fixed-width time buckets, each holding per-intent counts
+    and latency totals for the predictions made in it. Every update stamps
+    its bucket with a sequence number, so a reader can ask for just the
+    buckets that changed since its last read.
+    """
+
+    def __init__(self, bucket_seconds=5, buckets=120):
+        self.bucket_seconds = bucket_seconds
+        self.size = buckets
+        self._starts = [None] * buckets
+        self._counts = [None] * buckets
+        self._latency = [None] * buckets
+        self._stamps = [0] * buckets
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def record(self, intent, latency, now=None):
+        index = int((time.time() if now is None else now) // self.bucket_seconds)
+        slot = index % self.size
+        with self._lock:
+            if self._starts[slot] != index:
+                self._starts[slot] = index
+                self._counts[slot] = defaultdict(int)
+                self._latency[slot] = [0, 0.0, 0.0]   # count, sum, max
+            self._counts[slot][intent] += 1
+            stats = self._latency[slot]
+            stats[0] += 1
+            stats[1] += latency
+            if latency > stats[2]:
+                stats[2] = latency
+            self._seq += 1
+            self._stamps[slot] = self._seq
+
+    def changes(self, since=0, now=None):
+        """
+        (seq, buckets): the buckets inside the window updated after sequence
+        number `since`, oldest first, and the sequence number to pass next.
+        """
+        oldest = int((time.time() if now is None else now) // self.bucket_seconds) - self.size + 1
+        with self._lock:
+            seq = self._seq
+            changed = [
+                (self._starts[slot], dict(self._counts[slot]), list(self._latency[slot]))
+                for slot in range(self.size)
+                if self._stamps[slot] > since and self._starts[slot] >= oldest
+            ]
+        changed.sort()
+        return seq, [
+            {
+                "t": start * self.bucket_seconds,
+                "counts": counts,
+                "predictions": count,
+                "latency_avg_ms": round(total / count * 1000, 3),
+                "latency_max_ms": round(worst * 1000, 3),
+            }
+            for start, counts, (count, total, worst) in changed
+        ]
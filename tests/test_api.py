@@ -0,0 +1,55 @@
+"""
+The JSON classification and admin endpoints, through the Flask test client.
+"""
+
+import pytest
+
+import app_full
+
+
+@pytest.fixture
+def client():
+    return app_full.app.test_client()
+
+
+def test_classify_returns_first_match(client):
+    response = client.post("/api/classify", json={"text": "Could you send the invoice?"})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["intent"] == "request_invoice"
+    assert "invoice" in body["matched_keywords"]
+
+
+def test_batch_accepts_strings_and_objects_in_order(client):
+    response = client.post("/api/classify/batch", json={"emails": [
+        "Congratulations on the launch!",
+        {"id": "m2", "text": "Can we schedule a meeting?"},
+        "Hi there",
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [(r["id"], r["intent"]) for r in results] == [
+        (0, "congratulation"), ("m2", "meeting_request"), (2, "casual")]
+
+
+@pytest.mark.parametrize("ratio", [True, False, 0, 1.5, "0.5"])
+def test_invalid_multi_label_ratio_is_rejected(client, ratio):
+    response = client.post("/api/classify", json={"text": "hello", "mode": "score", "multi_label_ratio": ratio})
+    assert response.status_code == 400
+    assert "multi_label_ratio" in response.get_json()["error"]
+
+
+def test_batch_rejects_bad_item(client):
+    response = client.post("/api/classify/batch", json={"emails": ["ok", {"text": 5}]})
+    assert response.status_code == 400
+    assert "email #1" in response.get_json()["error"]
+
+
+@pytest.mark.parametrize("rate", [True, False, 0, 1.5, "0.5"])
+def test_shadow_rejects_invalid_sample_rate(client, monkeypatch, rate):
+    monkeypatch.setenv("EMAIL_INTENT_ADMIN_TOKEN", "secret")
+    response = client.post("/admin/shadow", json={"path": app_full.RULES_PATH, "sample_rate": rate},
+                           headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 400
+    assert "sample_rate" in response.get_json()["error"]
+    assert app_full._shadow is None
@@ -0,0 +1,48 @@
+"""
+Classifying mbox and Maildir archives on a process pool (archive.py).
+"""
+
+import mailbox
+from collections import Counter
+
+import pytest
+
+import app_full
+import archive
+
+BODIES = [
+    "Can we schedule a meeting tomorrow?",
+    "Please send the invoice for last month.",
+    "Hello, hope you are well.",
+    "Congratulations on the new role!",
+]
+
+
+def _fill(box):
+    keys = [box.add(f"From: a@example.com\nSubject: note {i}\nMessage-ID: <{i}@example.com>\n\n{body}\n")
+            for i, body in enumerate(BODIES)]
+    box.close()
+    return keys
+
+
+@pytest.mark.parametrize("kind", ["mbox", "maildir"])
+def test_results_follow_archive_order(tmp_path, kind):
+    if kind == "mbox":
+        path = str(tmp_path / "mail.mbox")
+        keys = _fill(mailbox.mbox(path))
+    else:
+        path = str(tmp_path / "Maildir")
+        keys = _fill(mailbox.Maildir(path))
+    # mbox keys count up in file order; Maildir messages come in sorted key order.
+    order = sorted(range(len(BODIES)), key=keys.__getitem__)
+
+    counts = Counter()
+    results = list(archive.classify_archive(path, workers=2, chunk_size=1, counts=counts,
+                                            rules_path=app_full.RULES_PATH))
+
+    expected = [app_full.classify_email(f"note {i}\n{BODIES[i]}\n")[0] for i in order]
+    assert [r["id"] for r in results] == [str(keys[i]) for i in order]
+    assert [r["message_id"] for r in results] == [f"<{i}@example.com>" for i in order]
+    assert [r["intent"] for r in results] == expected
+    assert counts == Counter(expected)
+    assert all(r["matched_keywords"] or r["intent"] == "casual" for r in results)
@@ -0,0 +1,121 @@
+"""
+asgi.py driven directly with ASGI messages: the async JSON handlers, the
+WSGI bridge (including a request body sent in pieces) and the native
+dashboard event stream.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+import app_full
+import asgi
+
+
+@pytest.fixture(autouse=True)
+def fresh_worker():
+    # Pools and semaphores are per event loop; every test runs its own loop.
+    asgi._worker = None
+    yield
+    if asgi._worker is not None:
+        asgi._worker.shutdown()
+        asgi._worker = None
+
+
+def call(path, method="GET", chunks=(b"",), headers=(), root_path="", hold=1.0):
+    """
+    Run one request; returns (status, headers, body chunks). After the body
+    has been received, receive() waits `hold` seconds and then reports a
+    disconnect.
+    """
+    scope = {
+        "type": "http", "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "root_path": root_path, "query_string": b"",
+        "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+        "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+    }
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(hold)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.application(scope, receive, send))
+    start = sent[0]
+    assert start["type"] == "http.response.start"
+    return start["status"], dict(start["headers"]), [m.get("body", b"") for m in sent[1:]]
+
+
+def test_async_classify():
+    status, headers, body = call("/api/classify", "POST", [json.dumps({"text": "Send the invoice"}).encode()])
+    assert status == 200
+    assert headers[b"content-type"] == b"application/json"
+    assert json.loads(b"".join(body))["intent"] == "request_invoice"
+
+
+def test_async_batch_reports_client_errors():
+    status, _, body = call("/api/classify/batch", "POST", [b'{"emails": 5}'])
+    assert status == 400
+    assert "emails" in json.loads(b"".join(body))["error"]
+
+
+def test_async_handler_rejects_get():
+    status, headers, _ = call("/api/classify")
+    assert status == 405
+    assert headers[b"allow"] == b"POST"
+
+
+def test_bridge_serves_flask_routes():
+    status, _, body = call("/api/rules")
+    assert status == 200
+    assert json.loads(b"".join(body))["keywords"] == list(app_full.get_rules().keywords)
+
+
+def test_bridge_streams_a_chunked_body():
+    pieces = [b"Hello team, ", b"could we sched", b"ule a meet", b"ing next week?" + b" filler" * 20000]
+    status, _, body = call("/api/classify/stream", "POST", pieces, headers=[("content-type", "text/plain")])
+    assert status == 200
+    result = json.loads(b"".join(body))
+    assert result["intent"] == "meeting_request"
+    assert result["bytes_read"] == sum(map(len, pieces))
+
+
+def test_bridge_passes_root_path_to_flask():
+    status, _, body = call("/", root_path="/intent")
+    assert status == 200
+    assert b'href="/intent/dashboard"' in b"".join(body)
+
+
+def test_root_path_is_stripped_from_the_path():
+    # ASGI servers now put root_path in front of scope["path"] as well.
+    status, _, body = call("/intent/dashboard", root_path="/intent")
+    assert status == 200
+    assert b'href="/intent/"' in b"".join(body)
+
+    status, _, body = call("/intent/api/classify", "POST", [json.dumps({"text": "Send the invoice"}).encode()],
+                           root_path="/intent")
+    assert status == 200
+    assert json.loads(b"".join(body))["intent"] == "request_invoice"
+
+    status, headers, _ = call("/intent/dashboard/stream", root_path="/intent", hold=0.05)
+    assert status == 200
+    assert headers[b"content-type"].startswith(b"text/event-stream")
+
+
+def test_dashboard_stream_ends_on_disconnect(monkeypatch):
+    monkeypatch.setattr(app_full, "LIVE_PUSH_INTERVAL", 0.01)
+    app_full.LIVE_COUNTERS.record("casual", 0.001)
+    status, headers, body = call("/dashboard/stream", hold=0.1)
+    assert status == 200
+    assert headers[b"content-type"].startswith(b"text/event-stream")
+    assert body[0] == app_full.LIVE_STREAM_PREAMBLE.encode()
+    event = json.loads(body[1].decode().removeprefix("data: "))
+    assert event["buckets"] and event["bucket_seconds"] == app_full.LIVE_COUNTERS.bucket_seconds
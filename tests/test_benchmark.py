@@ -0,0 +1,38 @@
+"""
+The synthetic corpus generator behind benchmark.py.
+"""
+
+from collections import Counter
+
+import pytest
+
+import app_full
+import benchmark
+
+RULES = app_full.get_rules()
+
+
+def test_unicode_ratio_zero_gives_ascii_corpus():
+    corpus = benchmark.generate_corpus(500, seed=1, unicode_ratio=0.0, rules=RULES)
+    assert all(text.isascii() for text, _ in corpus)
+
+
+def test_unicode_ratio_applies_to_default_label_too():
+    mix = {RULES.default_intent: 1.0}
+    words = [word for text, _ in benchmark.generate_corpus(500, seed=1, intent_mix=mix, rules=RULES)
+             for word in text.split()]
+    share = sum(not word.isascii() for word in words) / len(words)
+    assert 0.04 < share < 0.06
+
+
+def test_intent_mix_sets_label_shares():
+    mix = benchmark.parse_intent_mix("casual=3,request_invoice=1", RULES)
+    labels = Counter(label for _, label in benchmark.generate_corpus(4000, seed=2, intent_mix=mix, rules=RULES))
+    assert set(labels) == {"casual", "request_invoice"}
+    assert 2.6 < labels["casual"] / labels["request_invoice"] < 3.4
+
+
+@pytest.mark.parametrize("spec", ["unknown=1", "casual=x", "casual=-1", "casual=0"])
+def test_bad_intent_mix_is_rejected(spec):
+    with pytest.raises(ValueError):
+        benchmark.parse_intent_mix(spec, RULES)
@@ -0,0 +1,83 @@
+"""
+Both keyword matchers against the original substring cascade: for each
+intent in priority order, the keywords contained in the lowercased text.
+"""
+
+import random
+import re
+
+import pytest
+
+import app_full
+
+RULES = app_full.load_rules(app_full.RULES_PATH)
+SEPARATORS = ["", " ", "  ", " \t ", "\n", "x", "-", "’", " "]
+
+
+def cascade(text, rules):
+    # Whitespace runs are collapsed first: the automaton treats them as one space.
+    t = re.sub(" +", " ", app_full.normalize_text(text))
+    for rank, intent in enumerate(rules.intents):
+        ids = [kid for kid, keyword in enumerate(rules.keywords)
+               if rules.keyword_ranks[kid] == rank and keyword in t]
+        if ids:
+            return intent, rules.categories[rank], ids
+    return rules.default_intent, rules.default_intent, []
+
+
+def random_text(rng, rules):
+    parts = []
+    for _ in range(rng.randint(0, 12)):
+        keyword = rng.choice(rules.keywords)
+        choice = rng.random()
+        if choice < 0.3:
+            # A fragment of a keyword, so partial matches and failure links get exercised.
+            start = rng.randrange(len(keyword))
+            keyword = keyword[start:rng.randint(start + 1, len(keyword))]
+        elif choice < 0.5:
+            keyword = keyword.upper().replace(" ", rng.choice([" ", "  ", "\t", " \n "]))
+        parts.append(keyword)
+        parts.append(rng.choice(SEPARATORS))
+    return "".join(parts)
+
+
+def random_chunks(rng, text):
+    cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 6))))
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+@pytest.fixture(params=["substring", "automaton"])
+def rules(request, monkeypatch):
+    # The rule set gets whichever matcher the threshold selects.
+    threshold = len(RULES.keywords) + 1 if request.param == "substring" else 0
+    monkeypatch.setattr(app_full, "AUTOMATON_MIN_KEYWORDS", threshold)
+    compiled = app_full.load_rules(app_full.RULES_PATH)
+    expected = app_full.SubstringMatcher if request.param == "substring" else app_full.KeywordAutomaton
+    assert isinstance(compiled._matcher, expected)
+    return compiled
+
+
+def test_match_agrees_with_substring_cascade(rules):
+    rng = random.Random(1)
+    for _ in range(3000):
+        text = random_text(rng, rules)
+        assert rules.match(app_full.normalize_text(text)) == cascade(text, rules), text
+        assert rules.resolve(rules.hits(app_full.normalize_text(text))) == cascade(text, rules), text
+
+
+def test_stream_scanner_agrees_across_chunk_splits(rules):
+    rng = random.Random(2)
+    for _ in range(3000):
+        text = random_text(rng, rules)
+        scanner = rules.scanner(0)
+        for chunk in random_chunks(rng, text):
+            scanner.feed(chunk)
+        assert scanner.result() == cascade(text, rules), text
+
+
+def test_whitespace_run_matches_single_space(rules):
+    # Compiled under the same threshold, so it gets the same kind of matcher.
+    meeting = app_full.parse_rules({"intents": [{"intent": "meeting_request", "keywords": ["let's meet"]}]})
+    assert type(meeting._matcher) is type(rules._matcher)
+    assert meeting.match(app_full.normalize_text("Let’s \t\n meet"))[0] == "meeting_request"
+    assert meeting.match(app_full.normalize_text("lets meet"))[0] == meeting.default_intent
@@ -0,0 +1,62 @@
+"""
+compute_metrics() against the original per-label implementation it
+replaced, which is kept here verbatim as the reference.
+"""
+
+import random
+
+import app_full
+
+
+def baseline_compute_metrics(true_labels, pred_labels):
+    labels = sorted(set(true_labels))
+    total = len(true_labels)
+    correct = sum(1 for t, p in zip(true_labels, pred_labels) if t == p)
+    accuracy = round(correct / total, 2) if total > 0 else None
+
+    per_label = []
+    distribution = []
+
+    for label in labels:
+        tp = sum(1 for t, p in zip(true_labels, pred_labels)
+                 if t == label and p == label)
+        fp = sum(1 for t, p in zip(true_labels, pred_labels)
+                 if t != label and p == label)
+        fn = sum(1 for t, p in zip(true_labels, pred_labels)
+                 if t == label and p != label)
+
+        support = tp + fn
+        precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
+        recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
+        f1 = (2 * precision * recall / (precision + recall)) if (precision + recall) > 0 else 0.0
+
+        per_label.append({
+            "label": label,
+            "precision": round(precision, 2),
+            "recall": round(recall, 2),
+            "f1": round(f1, 2),
+            "support": support,
+        })
+        distribution.append({"label": label, "support": support})
+
+    return accuracy, per_label, distribution
+
+
+def test_compute_metrics_matches_baseline():
+    rng = random.Random(3)
+    # "spam" is only ever predicted, so it must not get a per-label row.
+    true_pool = app_full.INTENTS
+    pred_pool = app_full.INTENTS + ["spam"]
+    for _ in range(300):
+        n = rng.randint(0, 60)
+        true_labels = [rng.choice(true_pool[:rng.randint(1, len(true_pool))]) for _ in range(n)]
+        pred_labels = [rng.choice(pred_pool) for _ in range(n)]
+        assert (app_full.compute_metrics(true_labels, pred_labels)
+                == baseline_compute_metrics(true_labels, pred_labels))
+
+
+def test_compute_metrics_on_builtin_dataset():
+    true_labels = [label for _, label in app_full.EVALUATION_DATASET]
+    pred_labels = [app_full.classify_email(text)[0] for text, _ in app_full.EVALUATION_DATASET]
+    assert (app_full.compute_metrics(true_labels, pred_labels)
+            == baseline_compute_metrics(true_labels, pred_labels))
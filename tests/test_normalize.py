@@ -0,0 +1,55 @@
+"""
+normalize_text() against the single str.translate table it replaced,
+which is rebuilt here as the reference.
+"""
+
+import random
+import sys
+
+import app_full
+
+
+def reference_table():
+    table = {}
+    for cp in range(sys.maxunicode + 1):
+        ch = chr(cp)
+        if ch.isspace():
+            table[cp] = " "
+        elif 0xD800 <= cp < 0xE000:
+            continue
+        else:
+            folded = ch.casefold()
+            if folded != ch:
+                table[cp] = folded
+    for cp in range(0xFF01, 0xFF5F):
+        table[cp] = chr(cp - 0xFEE0).casefold()
+    table.update({ord(ch): "'" for ch in "‘’‚‛′´`"})
+    table.update({ord(ch): '"' for ch in "“”„‟″«»"})
+    table.update({ord(ch): "-" for ch in "‐‑‒–—―−﹣"})
+    table.update({ord(ch): None for ch in "­​‌‍⁠﻿"})
+    # The one intended change: the old table turned the full-width backtick
+    # into "`" without folding that on to "'" as it does for ASCII input.
+    table[0xFF40] = "'"
+    return table
+
+
+TABLE = reference_table()
+
+
+def test_every_code_point_folds_like_the_table():
+    for cp in range(0x30000):
+        if 0xD800 <= cp < 0xE000:
+            continue
+        ch = chr(cp)
+        assert app_full.normalize_text(ch) == ch.translate(TABLE), hex(cp)
+        # Next to a non-ASCII character the text takes the other path.
+        assert app_full.normalize_text("é" + ch) == ("é" + ch).translate(TABLE), hex(cp)
+
+
+def test_mixed_text_folds_like_the_table():
+    rng = random.Random(5)
+    alphabet = ("AbC xyz\t\n\r`'-" + "’“— 　​­"
+                + "ÀßΣİﬁＡｂ１" + "".join(app_full._WHITESPACE))
+    for _ in range(3000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        assert app_full.normalize_text(text) == text.translate(TABLE), repr(text)
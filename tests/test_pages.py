@@ -0,0 +1,28 @@
+"""
+The cached page shells must link relative to the prefix of the request.
+"""
+
+import app_full
+
+
+def test_links_follow_script_root():
+    app_full.create_app()
+    client = app_full.app.test_client()
+
+    for root in ("/intent", "", "/other/intent"):
+        for path in ("/", "/dashboard"):
+            page = client.get(path, environ_overrides={"SCRIPT_NAME": root}).get_data(as_text=True)
+            assert f'href="{root}/assets/app.css?v={app_full.CSS_VERSION}"' in page
+            if root:
+                assert 'href="/assets/' not in page
+
+        index = client.get("/", environ_overrides={"SCRIPT_NAME": root}).get_data(as_text=True)
+        assert f'href="{root}/dashboard"' in index
+        dashboard = client.get("/dashboard", environ_overrides={"SCRIPT_NAME": root}).get_data(as_text=True)
+        assert f'EventSource("{root}/dashboard/stream")' in dashboard
+
+
+def test_prediction_is_rendered_into_the_shell():
+    client = app_full.app.test_client()
+    page = client.post("/", data={"email_text": "Congratulations on the new role!"}).get_data(as_text=True)
+    assert "congratulation" in page
@@ -0,0 +1,33 @@
+"""
+Rule documents that parse_rules() must reject, each with an error naming
+the offending field.
+"""
+
+import pytest
+
+import app_full
+
+
+def document(**top):
+    rule = top.pop("rule", {})
+    return {"intents": [{"intent": "request_invoice", "keywords": ["invoice"], **rule}], **top}
+
+
+@pytest.mark.parametrize("data, field", [
+    (document(rule={"priority": True}), "'priority'"),
+    (document(rule={"priority": 1.5}), "'priority'"),
+    (document(default_score=True), "'default_score'"),
+    (document(default_score="high"), "'default_score'"),
+    (document(default_intent=5), "'default_intent'"),
+    (document(default_intent=""), "'default_intent'"),
+    (document(rule={"keywords": [{"phrase": "bill", "weight": True}]}), "'bill'"),
+])
+def test_invalid_values_are_rejected(data, field):
+    with pytest.raises(ValueError, match=field):
+        app_full.parse_rules(data)
+
+
+def test_valid_document_is_accepted():
+    rules = app_full.parse_rules(document(rule={"priority": 2}, default_intent="casual", default_score=0))
+    assert rules.match(app_full.normalize_text("Send the INVOICE"))[0] == "request_invoice"
+    assert rules.default_score == 0.0
@@ -0,0 +1,79 @@
+"""
+The SQLite prediction log and its hourly rollups (prediction_log.py).
+"""
+
+import gc
+import sqlite3
+import weakref
+
+import prediction_log
+
+
+def test_rows_are_rolled_up_per_hour(tmp_path):
+    log = prediction_log.PredictionLog(str(tmp_path / "log.db"), flush_interval=0.01)
+    now = 1_700_000_000.0
+    hour = int(now // 3600) * 3600
+    log.append("casual", (), None, 0.002, ts=hour + 10)
+    log.append("casual", (), None, 0.004, ts=hour + 20)
+    log.append("request_invoice", (0, 3), "abc", 0.001, ts=hour - 1800)
+    log.close()
+
+    traffic = log.traffic(hours=2, now=now)
+    assert traffic["total"] == 3
+    assert {row["intent"]: row["predictions"] for row in traffic["totals"]} == {"casual": 2, "request_invoice": 1}
+    assert {row["intent"]: row["counts"] for row in traffic["series"]} == {"casual": [0, 2], "request_invoice": [1, 0]}
+    assert log.written == 3 and log.dropped == 0
+
+
+class FailingConnection:
+    """A connection on which BEGIN fails, so no transaction is open."""
+
+    in_transaction = False
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, *args):
+        self.statements.append(sql)
+        if sql == "BEGIN":
+            raise sqlite3.OperationalError("database is locked")
+        if sql == "ROLLBACK":
+            raise sqlite3.OperationalError("cannot rollback - no transaction is active")
+
+
+def test_failed_begin_drops_rows_without_raising(tmp_path):
+    log = prediction_log.PredictionLog(str(tmp_path / "log.db"))
+    log.close()
+    log.append("casual", (), None, 0.001)
+    conn = FailingConnection()
+    log._flush(conn)
+    assert conn.statements == ["BEGIN"]
+    assert log.dropped == 1
+
+
+def test_closed_logs_are_not_kept_alive(tmp_path):
+    log = prediction_log.PredictionLog(str(tmp_path / "log.db"))
+    assert log in prediction_log._open_logs
+    log.close()
+    assert log not in prediction_log._open_logs
+
+    ref = weakref.ref(log)
+    del log
+    gc.collect()
+    assert ref() is None
+
+
+def test_fork_hook_restarts_the_writer_of_open_logs(tmp_path):
+    log = prediction_log.PredictionLog(str(tmp_path / "log.db"), flush_interval=0.01)
+    closed = prediction_log.PredictionLog(str(tmp_path / "closed.db"))
+    closed.close()
+    writer = log._writer
+    # What os.register_at_fork runs in a child process.
+    prediction_log._after_fork_in_child()
+    assert log._writer is not writer and log._writer.is_alive()
+    assert not closed._writer.is_alive()
+
+    log.append("casual", (), None, 0.001)
+    log.close()
+    writer.join()
+    assert log.written == 1
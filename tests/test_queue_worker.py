@@ -0,0 +1,163 @@
+"""
+The SQLite queue backend, the result sinks and the worker loop of
+queue_worker.py.
+"""
+
+import json
+import sqlite3
+
+import pytest
+
+import app_full
+import queue_worker
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return queue_worker.SQLiteQueue(str(tmp_path / "queue.db"), max_attempts=2)
+
+
+def test_lease_ack_release(backend):
+    assert backend.enqueue(["a", "b", "c"]) == 3
+    first = backend.lease(2, 60)
+    assert [payload for _, payload in first] == ["a", "b"]
+    # Leased messages are not handed out again while the lease runs.
+    assert [payload for _, payload in backend.lease(5, 60)] == ["c"]
+
+    (a, _), (b, _) = first
+    backend.ack([a])
+    backend.release([b])
+    assert backend.stats() == {"done": 1, "ready": 1, "leased": 1}
+    assert backend.lease(5, 60) == [(b, "b")]
+    assert backend.pending() == 2
+
+
+def test_release_parks_message_after_max_attempts(backend):
+    backend.enqueue(["poison"])
+    for _ in range(2):
+        [(mid, _)] = backend.lease(1, 60)
+        backend.release([mid])
+    assert backend.stats() == {"failed": 1}
+    assert backend.lease(1, 60) == []
+    assert backend.pending() == 0
+
+
+def test_expired_lease_is_retried_then_parked(backend):
+    backend.enqueue(["crashes its worker"])
+    # A negative lease has already expired, as if the worker had died.
+    assert len(backend.lease(1, -1)) == 1
+    assert len(backend.lease(1, -1)) == 1
+    assert backend.lease(1, -1) == []
+    assert backend.stats() == {"failed": 1}
+
+
+@pytest.mark.parametrize("payload", ['{"text": 5}', '{"id": 1}', '{not json', '{"text": "hi", "format": "pdf"}'])
+def test_classify_payload_rejects_bad_objects(payload):
+    with pytest.raises(ValueError):
+        queue_worker.classify_payload(payload, app_full.get_rules())
+
+
+def test_classify_payload_accepts_objects_and_plain_text():
+    rules = app_full.get_rules()
+    assert queue_worker.classify_payload('{"text": "Please send the invoice"}', rules)["intent"] == "request_invoice"
+    assert queue_worker.classify_payload("Congratulations, well done!", rules)["intent"] == "congratulation"
+
+
+def test_worker_stores_results_and_parks_poison_messages(backend):
+    backend.enqueue([
+        json.dumps({"text": "Can we schedule a meeting?"}),
+        json.dumps({"text": 5}),
+        "{truncated",
+        "Please share the invoice",
+    ])
+    sink = queue_worker.SQLiteResultSink(backend)
+    worker = queue_worker.ClassificationWorker(backend, sink, batch_size=2, idle_sleep=0.01)
+    try:
+        worker.run(drain=True)
+    finally:
+        sink.close()
+
+    assert backend.stats() == {"done": 2, "failed": 2}
+    assert worker.processed == 2
+    assert worker.failed == 4   # two bad messages, two attempts each
+    results = {mid: result["intent"] for mid, result in backend.iter_results()}
+    assert results == {1: "meeting_request", 4: "request_invoice"}
+
+
+class FlakyConnection:
+    """
+    A connection whose executemany() fails the way a locked database does
+    while the shared `failures` counter lasts.
+    """
+
+    failures = 0
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def executemany(self, sql, rows):
+        if FlakyConnection.failures:
+            FlakyConnection.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return self._conn.executemany(sql, rows)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+@pytest.mark.parametrize("failures, stored", [(1, True), (3, False)])
+def test_sqlite_sink_retries_locked_writes(backend, monkeypatch, failures, stored):
+    connect = queue_worker._connect
+    monkeypatch.setattr(queue_worker, "_connect", lambda path: FlakyConnection(connect(path)))
+    monkeypatch.setattr(FlakyConnection, "failures", failures)
+    backend.enqueue(["hello"])
+    [(mid, _)] = backend.lease(1, 60)
+    sink = queue_worker.SQLiteResultSink(backend, retries=2, retry_delay=0)
+    sink.submit([(mid, {"intent": "casual"})])
+    sink.close()
+
+    if stored:
+        # The first write failed, the retry went through: nothing is left broken.
+        sink.check()
+        assert backend.stats() == {"done": 1}
+        assert [m for m, _ in backend.iter_results()] == [mid]
+    else:
+        with pytest.raises(RuntimeError):
+            sink.check()
+        assert backend.stats() == {"ready": 1}
+
+
+def test_jsonl_sink_acks_after_writing(backend, tmp_path):
+    backend.enqueue(["Congratulations!", "hello"])
+    out = tmp_path / "results.jsonl"
+    sink = queue_worker.JSONLResultSink(str(out), backend)
+    worker = queue_worker.ClassificationWorker(backend, sink, idle_sleep=0.01)
+    try:
+        worker.run(drain=True)
+    finally:
+        sink.close()
+
+    rows = [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()]
+    assert [(row["message_id"], row["intent"]) for row in rows] == [(1, "congratulation"), (2, "casual")]
+    assert backend.stats() == {"done": 2}
+
+
+class SlowSink(queue_worker.ResultSink):
+    def __init__(self, lags):
+        self.lags = list(lags)
+        self.batches = []
+
+    def submit(self, results, on_stored=None):
+        self.batches.append(results)
+
+    def lag(self):
+        return self.lags.pop(0) if self.lags else 0
+
+
+def test_worker_waits_while_sink_lags(backend):
+    backend.enqueue(["hello"])
+    sink = SlowSink([4, 4, 1])
+    worker = queue_worker.ClassificationWorker(backend, sink, max_lag=2)
+    assert worker.run_once() == 1
+    assert worker.throttled == 2
+    assert len(sink.batches) == 1
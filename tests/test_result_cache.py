@@ -0,0 +1,28 @@
+"""
+The result cache in front of match_email().
+"""
+
+import app_full
+
+
+def test_hit_skips_normalization(monkeypatch):
+    monkeypatch.setattr(app_full, "RESULT_CACHE", app_full.ClassificationCache(16))
+    text = "Could we SCHEDULE a meeting for Monday?"
+    first = app_full.match_email(text)
+
+    calls = []
+    normalize = app_full.normalize_text
+    monkeypatch.setattr(app_full, "normalize_text", lambda t: calls.append(t) or normalize(t))
+    assert app_full.match_email(text) == first
+    assert calls == []
+    assert app_full.RESULT_CACHE.stats()["hits"] == 1
+
+
+def test_entries_follow_the_rules_version(monkeypatch):
+    monkeypatch.setattr(app_full, "RESULT_CACHE", app_full.ClassificationCache(16))
+    text = "please send the invoice"
+    assert app_full.match_email(text)[0] == "request_invoice"
+
+    other = app_full.parse_rules({"intents": [{"intent": "congratulation", "keywords": ["invoice"]}]})
+    assert app_full.match_email(text, other)[0] == "congratulation"
+    assert app_full.RESULT_CACHE.stats()["hits"] == 0
@@ -0,0 +1,88 @@
+"""
+Picking up rule-file changes at runtime: the per-process rule-file watcher
+and /admin/reload-rules.
+"""
+
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+import app_full
+
+
+@pytest.fixture
+def no_watcher(monkeypatch):
+    # As in a freshly forked worker: no watcher has been started here yet.
+    monkeypatch.setattr(app_full, "_rules_watcher", None)
+    monkeypatch.setattr(app_full, "_rules_watcher_pid", None)
+    yield
+    if app_full._rules_watcher is not None:
+        app_full._rules_watcher.stop()
+
+
+def test_first_request_starts_the_watcher_once(monkeypatch, no_watcher):
+    monkeypatch.setenv("EMAIL_INTENT_RULES_WATCH", "60")
+    client = app_full.app.test_client()
+    assert client.get("/api/rules").status_code == 200
+    watcher = app_full._rules_watcher
+    assert watcher is not None and watcher.is_alive()
+
+    client.get("/api/rules")
+    assert app_full._rules_watcher is watcher
+    assert app_full.start_rules_watcher() is watcher
+
+
+def test_no_watcher_without_interval(monkeypatch, no_watcher):
+    monkeypatch.delenv("EMAIL_INTENT_RULES_WATCH", raising=False)
+    app_full.app.test_client().get("/api/rules")
+    assert app_full._rules_watcher is None
+
+
+@pytest.fixture
+def rules_copy(tmp_path, monkeypatch):
+    path = str(tmp_path / "rules.json")
+    shutil.copy(app_full.RULES_PATH, path)
+    monkeypatch.setattr(app_full, "_active_rules", app_full.load_rules(path))
+    monkeypatch.setenv("EMAIL_INTENT_ADMIN_TOKEN", "secret")
+    return path
+
+
+def test_admin_reload_reaches_other_workers(rules_copy, monkeypatch):
+    monkeypatch.setenv("EMAIL_INTENT_RULES_WATCH", "0.01")
+    # An edit that keeps the size and mtime goes unnoticed by the watchers.
+    stamp = os.stat(rules_copy).st_mtime_ns - 10 ** 9
+    os.utime(rules_copy, ns=(stamp, stamp))
+
+    reloads = []
+    reload_rules = app_full.reload_rules
+
+    def recording_reload(path=None):
+        reloads.append(threading.current_thread().name)
+        return reload_rules(path)
+
+    monkeypatch.setattr(app_full, "reload_rules", recording_reload)
+    # Stands in for the watcher of another worker process.
+    other_worker = app_full.RuleFileWatcher(rules_copy, 0.01)
+    other_worker.start()
+    try:
+        response = app_full.app.test_client().post("/admin/reload-rules", headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 200
+        assert response.get_json()["propagated"] is True
+        deadline = time.monotonic() + 5
+        while "rule-file-watcher" not in reloads and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        other_worker.stop()
+    assert reloads[0] != "rule-file-watcher"
+    assert "rule-file-watcher" in reloads
+
+
+def test_admin_reload_without_watcher_is_local(rules_copy, monkeypatch):
+    monkeypatch.delenv("EMAIL_INTENT_RULES_WATCH", raising=False)
+    response = app_full.app.test_client().post("/admin/reload-rules", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.get_json()["propagated"] is False
+    assert app_full.get_rules().source == rules_copy
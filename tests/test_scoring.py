@@ -0,0 +1,44 @@
+"""
+Weighted scoring: score_batch() must give score_email()'s answer for
+every email, on both the NumPy path and the pure-Python fallback.
+"""
+
+import pytest
+
+import app_full
+import benchmark
+
+WEIGHTED = app_full.parse_rules({
+    "default_score": 0.4,
+    "intents": [
+        {"intent": "request_invoice", "keywords": [
+            "invoice", {"phrase": "bill", "weight": 0.8, "weights": {"meeting_request": 0.2}}]},
+        {"intent": "meeting_request", "keywords": [
+            "meeting", {"phrase": "call", "weight": 0.5, "weights": {"casual": 0.3}}]},
+        {"intent": "congratulation", "keywords": [
+            "congratulations", {"phrase": "well done", "weights": {"request_invoice": -0.5}}]},
+    ],
+})
+
+TEXTS = [text for text, _ in benchmark.generate_corpus(300, seed=4, keyword_density=0.05, rules=app_full.get_rules())]
+TEXTS += ["", "invoice bill meeting call", "well done on the invoice", "call me", "Congratulations!"]
+
+
+@pytest.mark.parametrize("rules", [app_full.get_rules(), WEIGHTED], ids=["rules.json", "weighted"])
+@pytest.mark.parametrize("ratio", [0.5, 0.2, 1.0])
+def test_score_batch_matches_score_email(rules, ratio):
+    expected = [app_full.score_email(text, rules, ratio) for text in TEXTS]
+    assert app_full.score_batch(TEXTS, rules, ratio) == expected
+
+
+def test_score_batch_without_numpy(monkeypatch):
+    monkeypatch.setattr(app_full, "np", None)
+    expected = [app_full.score_email(text, WEIGHTED) for text in TEXTS]
+    assert app_full.score_batch(TEXTS, WEIGHTED) == expected
+
+
+def test_score_batch_dense_numpy(monkeypatch):
+    # Without SciPy the hit matrix is accumulated densely with np.add.at.
+    monkeypatch.setattr(app_full, "sparse", None)
+    expected = [app_full.score_email(text, WEIGHTED) for text in TEXTS]
+    assert app_full.score_batch(TEXTS, WEIGHTED) == expected